@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+""" End to end benchmark of atlas_nagios.py against the local mock api """
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+import atlas_mock
+import atlas_nagios
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'atlas_nagios.py')
+#Command line of the check of each mock type, the measurement id is
+#filled in, healthy probes pass every check
+CHECKS = {
+    'ssl': ['ssl', '%s', '--common_name', atlas_mock.COMMON_NAME,
+            '--sha1hash', atlas_mock.SHA1],
+    'ping': ['ping', '%s', '--rtt_max', '100', '--rtt_avg', '100'],
+    'http': ['http', '%s', '--status_code', '200'],
+    'dns-a': ['dns', 'A', '%s', '--rcode', 'NOERROR', '--flags', 'qr,rd',
+            '--a-record', '192.0.2.1'],
+    'dns-aaaa': ['dns', 'AAAA', '%s', '--rcode', 'NOERROR',
+            '--aaaa-record', '2001:db8::1'],
+    'dns-cname': ['dns', 'CNAME', '%s', '--rcode', 'NOERROR',
+            '--cname-record', atlas_mock.ZONE],
+    'dns-ds': ['dns', 'DS', '%s', '--rcode', 'NOERROR', '--keytag', '12345'],
+    'dns-dnskey': ['dns', 'DNSKEY', '%s', '--rcode', 'NOERROR'],
+    'dns-soa': ['dns', 'SOA', '%s', '--rcode', 'NOERROR',
+            '--serial', str(atlas_mock.SERIAL)],
+    'traceroute': ['traceroute', '%s', '--hops', atlas_mock.TRANSIT,
+            '--max-hops', '10'],
+    }
+#Results are compared with the previous run with the same key
+KEY = ('type', 'probes', 'failures')
+
+
+def check_argv(measurement_type, probes, failures):
+    """Return the check arguments for a mock measurement"""
+    measurement_id = '%s-%d-%s' % (measurement_type, probes, failures)
+    return [measurement_id if arg == '%s' else arg
+            for arg in CHECKS[measurement_type]]
+
+
+def run_process(python, api_url, argv):
+    """
+    Run the check in a new interpreter
+    returns (exit code, wall seconds, cpu seconds, peak rss in kB)
+    """
+    start = time.time()
+    process = subprocess.Popen([python, SCRIPT, '--api-url', api_url]
+            + argv, stdout=open(os.devnull, 'w'))
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - start
+    process.returncode = os.WEXITSTATUS(status)
+    return (process.returncode, wall, usage.ru_utime + usage.ru_stime,
+            usage.ru_maxrss)
+
+
+def run_phases(api_url, argv):
+    """
+    Run the check in this interpreter
+    returns the seconds spent fetching and checking the measurement
+    """
+    args = atlas_nagios.arg_parse(['--api-url', api_url] + argv)
+    atlas_nagios.configure_client(args)
+    start = time.time()
+    measurements = atlas_nagios.fetch_results(args)
+    fetched = time.time()
+    atlas_nagios.check_result(args, measurements)
+    return fetched - start, time.time() - fetched
+
+
+def run_state(api_url, argv):
+    """
+    Run the check twice in this interpreter with a new --state-dir
+    returns the seconds spent checking the unchanged results the second
+    time, to compare with the check time without a state
+    """
+    state_dir = tempfile.mkdtemp()
+    try:
+        run_phases(api_url, argv + ['--state-dir', state_dir])
+        return run_phases(api_url, argv + ['--state-dir', state_dir])[1]
+    finally:
+        shutil.rmtree(state_dir)
+
+
+def bench(python, api_url, measurement_type, probes, failures, repeat,
+        state=False):
+    """
+    Benchmark one check, the best of repeat runs of each metric
+    with state the check time of an unchanged rerun with --state-dir too
+    """
+    argv = check_argv(measurement_type, probes, failures)
+    runs = [run_process(python, api_url, argv) for _ in xrange(repeat)]
+    phases = [run_phases(api_url, argv) for _ in xrange(repeat)]
+    result = {
+        'type': measurement_type,
+        'probes': probes,
+        'failures': failures,
+        'status': runs[0][0],
+        'wall': min(run[1] for run in runs),
+        'cpu': min(run[2] for run in runs),
+        'rss_kb': min(run[3] for run in runs),
+        'fetch': min(phase[0] for phase in phases),
+        'check': min(phase[1] for phase in phases),
+        }
+    if state:
+        result['state'] = min(run_state(api_url, argv)
+                for _ in xrange(repeat))
+    return result
+
+
+def load_previous(path):
+    """Return the last stored result of each benchmark key"""
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path) as results:
+        for line in results:
+            try:
+                result = json.loads(line)
+                previous[tuple(result[key] for key in KEY)] = result
+            except (ValueError, KeyError):
+                continue
+    return previous
+
+
+def regressions(result, previous, threshold):
+    """
+    Return the metrics of result worse than previous by threshold
+    metrics missing from either run, e.g. state without --state, are
+    skipped
+    """
+    if previous is None:
+        return []
+    return [metric for metric in ('wall', 'cpu', 'rss_kb', 'fetch', 'check',
+            'state')
+            if result.get(metric) is not None and previous.get(metric) and
+            result[metric] > previous[metric] * (1 + threshold)]
+
+
+def arg_parse():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--types', default=','.join(atlas_mock.TYPES),
+            help='Coma seperated list of mock measurement types')
+    parser.add_argument('--probes', default='10,1000,50000',
+            help='Coma seperated list of probe counts')
+    parser.add_argument('--failures', type=float, default=0.05,
+            help='Fraction of failing probes')
+    parser.add_argument('--missing', type=float, default=0.01,
+            help='Fraction of probes without data')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='Keep the best of # runs')
+    parser.add_argument('--python', default=sys.executable,
+            help='Interpreter running atlas_nagios.py')
+    parser.add_argument('--results', default='atlas_bench.jsonl',
+            help='File the results are appended to and compared with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+            help='Flag metrics worse than the previous run by this fraction')
+    parser.add_argument('--state', action='store_true',
+            help='Also time the check of unchanged results with --state-dir')
+    parser.add_argument('--label', default='',
+            help='Stored with the results, e.g. a commit id')
+    return parser.parse_args()
+
+
+def main():
+    """main function"""
+    args = arg_parse()
+    server = atlas_mock.MockServer(('127.0.0.1', 0), missing=args.missing)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    previous = load_previous(args.results)
+    flagged = 0
+    print "%-10s %6s %8s %8s %9s %8s %8s %8s %s" % ('type', 'probes',
+            'wall', 'cpu', 'rss_kB', 'fetch', 'check', 'state',
+            'regressions')
+    with open(args.results, 'a') as results:
+        for measurement_type in args.types.split(','):
+            for probes in [int(count) for count in args.probes.split(',')]:
+                result = bench(args.python, server.api_url,
+                        measurement_type, probes, args.failures,
+                        args.repeat, args.state)
+                result['time'] = int(time.time())
+                result['label'] = args.label
+                worse = regressions(result, previous.get(
+                        tuple(result[key] for key in KEY)), args.threshold)
+                flagged += len(worse)
+                print "%-10s %6d %8.3f %8.3f %9d %8.3f %8.3f %8s %s" % (
+                        measurement_type, probes, result['wall'],
+                        result['cpu'], result['rss_kb'], result['fetch'],
+                        result['check'], "%.3f" % result['state']
+                        if 'state' in result else '-', ','.join(worse))
+                sys.stdout.flush()
+                results.write(json.dumps(result, sort_keys=True) + '\n')
+    server.shutdown()
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == '__main__':
+    main()
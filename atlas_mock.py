@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+""" Local stand-in for the ripe atlas api serving synthetic measurements """
+import sys
+import time
+import json
+import socket
+import random
+import argparse
+import itertools
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+#Types served, the measurement id is <type>[-<probes>[-<failures>]]
+#e.g. /api/v1/measurement/dns-soa-10000-0.05/latest/, results are pushed
+#as json lines by /api/v1/measurement/<id>/stream/
+TYPES = ('ssl', 'ping', 'http', 'dns-a', 'dns-aaaa', 'dns-cname',
+        'dns-ds', 'dns-dnskey', 'dns-soa', 'traceroute')
+#Values the healthy probes report, see the check command lines in
+#atlas_bench.py
+COMMON_NAME = "www.example.com"
+SHA1 = "AB:CD:EF:01:23:45:67:89:AB:CD:EF:01:23:45:67:89:AB:CD:EF:01"
+SERIAL = 2015010100
+ZONE = "example.com."
+#Hop every healthy path goes through
+TRANSIT = "192.0.2.3"
+
+
+def ssl_payload(probe_id, now, failed):
+    """Return the payload of an ssl result"""
+    expiry = time.gmtime(now + (5 if failed else 365) * 24 * 60 * 60)
+    return [1, now, [[COMMON_NAME, "Example CA", "Example Org", "NL",
+            time.strftime("%Y%m%d%H%M%SZ", expiry),
+            SHA1 if not failed else SHA1[::-1]]]]
+
+
+def ping_payload(probe_id, now, failed):
+    """Return the payload of a ping result"""
+    rtt = 500.0 if failed else 10.0 + probe_id % 40
+    return [round(rtt, 3), now, 3]
+
+
+def http_payload(probe_id, now, failed):
+    """Return the payload of an http result"""
+    if failed and probe_id % 2:
+        return [1, now, [{'dnserr': "non-recoverable failure"}]]
+    return [1, now, [{'res': 500 if failed else 200}]]
+
+
+def traceroute_payload(probe_id, now, failed):
+    """Return the payload of a traceroute result"""
+    if failed:
+        #a longer detour avoiding the transit hop
+        hops = ["198.51.100.%d" % hop for hop in xrange(1, 13)]
+    else:
+        hops = ["10.%d.0.1" % (probe_id % 250), "192.0.2.1", "192.0.2.2",
+                TRANSIT, "192.0.2.4", "203.0.113.1"]
+    result = []
+    for number, address in enumerate(hops, 1):
+        if number == 2 and probe_id % 10 == 0:
+            replies = [{'x': "*"}] * 3
+        else:
+            replies = [{'from': address, 'rtt': 1.0 * number, 'size': 68,
+                    'ttl': 255 - number}] * 3
+        result.append({'hop': number, 'result': replies})
+    return [1, now, result]
+
+
+def dns_payload(qtype, answers):
+    """Return a function building the payload of a dns result"""
+    def payload(probe_id, now, failed):
+        """Return the payload of a dns result"""
+        return [1, now, {
+            'additional': 0,
+            'authority': 0,
+            'question': "%s IN %s" % (ZONE, qtype),
+            'rcode': "SERVFAIL" if failed else "NOERROR",
+            'flags': "qr rd ra",
+            'answer': [] if failed else answers,
+            }]
+    return payload
+
+
+PAYLOADS = {
+    'ssl': ssl_payload,
+    'ping': ping_payload,
+    'http': http_payload,
+    'dns-a': dns_payload("A", [
+            "%s 300 IN A 192.0.2.1" % ZONE,
+            "%s 300 IN RRSIG A 8 2 300 20300101000000 20150101000000 "
+            "12345 %s c2lnbmF0dXJl" % (ZONE, ZONE)]),
+    'dns-aaaa': dns_payload("AAAA", ["%s 300 IN AAAA 2001:db8::1" % ZONE]),
+    'dns-cname': dns_payload("CNAME", [
+            "www.%s 300 IN CNAME %s" % (ZONE, ZONE)]),
+    'dns-ds': dns_payload("DS", [
+            "%s 3600 IN DS 12345 8 2 0123456789ABCDEF" % ZONE]),
+    'dns-dnskey': dns_payload("DNSKEY", [
+            "%s 3600 IN DNSKEY 257 3 8 AwEAAc2tZXk=" % ZONE]),
+    'dns-soa': dns_payload("SOA", [
+            "%s 300 IN SOA ns.%s hostmaster.%s %d 7200 3600 1209600 300" % (
+            ZONE, ZONE, ZONE, SERIAL)]),
+    'traceroute': traceroute_payload,
+    }
+
+
+def parse_id(measurement_id, probes=100, failures=0.0):
+    """Return the (type, probes, failures) encoded in measurement_id"""
+    for name in sorted(TYPES, key=len, reverse=True):
+        if measurement_id == name or measurement_id.startswith(name + '-'):
+            parts = measurement_id[len(name) + 1:].split('-')
+            if parts[0]:
+                probes = int(parts[0])
+            if len(parts) > 1:
+                failures = float(parts[1])
+            return name, probes, failures
+    raise ValueError("unknown measurement %s" % measurement_id)
+
+
+def generate(measurement_type, probes, failures, missing=0.0, now=None,
+        seed=0):
+    """
+    Return the latest results of a synthetic measurement
+    a failures fraction of the probes fail the bench checks and a
+    missing fraction has no data
+    """
+    if now is None:
+        now = int(time.time()) - 60
+    payload = PAYLOADS[measurement_type]
+    rand = random.Random(seed)
+    results = []
+    for probe_id in xrange(1, probes + 1):
+        draw = rand.random()
+        if draw < missing:
+            results.append([1, probe_id, 0, 0, 0, None])
+        else:
+            results.append([1, probe_id, 0, 0, 0,
+                    payload(probe_id, now, draw < missing + failures)])
+    return results
+
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve the latest and historical results of synthetic measurements"""
+
+    def do_GET(self):
+        """
+        Answer /measurement/<id>/latest/, /measurement/<id>/result/ and
+        /measurement/<id>/stream/
+        """
+        url = urlparse.urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        params = dict(urlparse.parse_qsl(url.query))
+        try:
+            measurement_id, endpoint = parts[parts.index('measurement') + 1:]
+            if endpoint == 'stream':
+                lines = self.server.stream(measurement_id)
+            else:
+                body = self.server.body(measurement_id, endpoint, params)
+        except ValueError as error:
+            self.send_error(404, str(error))
+            return
+        if endpoint == 'stream':
+            self.push(lines)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def push(self, lines):
+        """Send lines as they are generated until the client goes away"""
+        #chunked transfer encoding needs http/1.1
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for line in lines:
+                self.wfile.write('%x\r\n%s\n\r\n' % (len(line) + 1, line))
+        except socket.error:
+            pass
+        self.close_connection = 1
+
+    def log_message(self, format, *args):
+        """Only log with --verbose"""
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self,
+                    format, *args)
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded http server answering like the atlas api
+    generated bodies are kept so repeated requests cost only the send
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, probes=100, failures=0.0, missing=0.0,
+            interval=240, verbose=False, stream_rate=100, replay=None):
+        """
+        Listen on address, probes/failures are the id defaults
+        streams push stream_rate results per second, the results of
+        replay instead of synthetic ones if it is set
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, MockHandler)
+        self.probes = probes
+        self.failures = failures
+        self.missing = missing
+        self.interval = interval
+        self.verbose = verbose
+        self.stream_rate = max(1, int(stream_rate))
+        self.replay = replay
+        self.bodies = {}
+
+    def body(self, measurement_id, endpoint, params):
+        """Return the json body of an endpoint of measurement_id"""
+        measurement_type, probes, failures = parse_id(measurement_id,
+                self.probes, self.failures)
+        if endpoint == 'latest':
+            key = (measurement_type, probes, failures)
+            if key not in self.bodies:
+                self.bodies[key] = json.dumps(generate(measurement_type,
+                        probes, failures, self.missing))
+            return self.bodies[key]
+        if endpoint == 'result':
+            results = []
+            start = int(params.get('start', 0))
+            stop = int(params.get('stop', time.time()))
+            first = start + (-start % self.interval)
+            for when in xrange(first, stop + 1, self.interval):
+                results.extend(generate(measurement_type, probes, failures,
+                        self.missing, when, when))
+            return json.dumps(results)
+        raise ValueError("unknown endpoint %s" % endpoint)
+
+    def stream(self, measurement_id):
+        """
+        Yield the json lines of the result stream of measurement_id
+        stream_rate results are pushed every second followed by an empty
+        keep-alive line. synthetic results are pushed round after round
+        of all the probes, each round with other failing probes, replayed
+        results once
+        """
+        if self.replay is not None:
+            rounds = iter([self.replay])
+        else:
+            measurement_type, probes, failures = parse_id(measurement_id,
+                    self.probes, self.failures)
+            rounds = (generate(measurement_type, probes, failures,
+                    self.missing, int(time.time()), seed)
+                    for seed in itertools.count(1))
+        for results in rounds:
+            for start in xrange(0, len(results), self.stream_rate):
+                for result in results[start:start + self.stream_rate]:
+                    yield json.dumps(result)
+                yield ''
+                time.sleep(1)
+        while True:
+            yield ''
+            time.sleep(1)
+
+    @property
+    def api_url(self):
+        """The base url to pass to atlas_nagios.py --api-url"""
+        return "http://%s:%d/api/v1" % self.server_address
+
+
+def arg_parse():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1',
+            help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000,
+            help='Port to listen on')
+    parser.add_argument('--probes', type=int, default=100,
+            help='Probes of a measurement id without a probe count')
+    parser.add_argument('--failures', type=float, default=0.0,
+            help='Fraction of failing probes of an id without one')
+    parser.add_argument('--missing', type=float, default=0.0,
+            help='Fraction of probes without data')
+    parser.add_argument('--interval', type=int, default=240,
+            help='Seconds between the historical results of a probe')
+    parser.add_argument('--stream-rate', type=int, default=100,
+            help='Results pushed per second by a stream')
+    parser.add_argument('--replay',
+            help='Json file with the results every stream pushes, e.g. '
+            'saved latest results')
+    parser.add_argument('-v', '--verbose', action='store_true',
+            help='Log requests')
+    return parser.parse_args()
+
+
+def main():
+    """main function"""
+    args = arg_parse()
+    replay = None
+    if args.replay:
+        with open(args.replay) as results:
+            replay = json.load(results)
+    server = MockServer((args.host, args.port), args.probes, args.failures,
+            args.missing, args.interval, args.verbose, args.stream_rate,
+            replay)
+    print "Serving %s, measurement ids: %s" % (server.api_url,
+            ", ".join(TYPES))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,129 @@
 #!/usr/bin/env python
 """ Class to use the ripe atlas platform to do nagios checks """
+import os
 import sys
 import time
 import argparse
-import requests
+import importlib
+import collections
 import json
+import shlex
+import re
+import random
+import bisect
+import heapq
+import types
+import hashlib
+import zlib
+import mmap
+import struct
+import tempfile
+import urlparse
+import threading
+import fcntl
+import socket
+import timeit
+import itertools
+import Queue
+import SocketServer
+from StringIO import StringIO
+
+
+class LazyModule(object):
+    """
+    Stand-in for a module which is only imported when it is first used
+    requests and numpy take longer to import than most checks take to run
+    """
+
+    def __init__(self, name, *submodules):
+        """Initiate the stand-in of module name, submodules are imported too"""
+        self.name = name
+        self.submodules = submodules
+        self.module = None
+
+    def load(self):
+        """Import and return the module"""
+        if self.module is None:
+            module = importlib.import_module(self.name)
+            for submodule in self.submodules:
+                importlib.import_module(submodule)
+            self.module = module
+        return self.module
+
+    def available(self):
+        """Return whether the module can be imported"""
+        try:
+            self.load()
+        except ImportError:
+            return False
+        return True
+
+    def __getattr__(self, attribute):
+        """Return attribute of the module, importing it"""
+        return getattr(self.load(), attribute)
+
+
+requests = LazyModule('requests', 'requests.adapters')
+urllib = LazyModule('urllib')
+#optional, only the --columnar engine uses numpy
+numpy = LazyModule('numpy')
+sqlite3 = LazyModule('sqlite3')
+multiprocessing_pool = LazyModule('multiprocessing.pool')
+
+API_URL = "https://atlas.ripe.net/api/v1"
+FETCH_ERROR = "Unknown: Fatal error when reading request: %s"
+CHUNK_SIZE = 64 * 1024
+#Reused between checks when running as a server
+CLIENT = None
+PARSER = None
+SELECTOR = None
+PARSER_LOCK = threading.Lock()
+#Parsers of the check types whose arguments are added on first use
+UNBUILT_PARSERS = {}
+#Check types by command line path, e.g. ('dns', 'A'): [help, class], and
+#help and title of the commands grouping them, see register_check_type
+CHECK_TYPES = collections.OrderedDict()
+CHECK_GROUPS = {}
+PLANS = {}
+MAX_PLANS = 1024
+#Shared dns records and tokens, see parse_record
+RECORDS = {}
+TOKENS = {}
+MAX_RECORDS = 65536
+#Tokens of a record with quoted character strings, e.g. TXT rdata
+QUOTED_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|\S+')
+#Shared traceroute paths and their hashes, see intern_path, and the path
+#baselines of the check run by each thread, see get_baseline
+PATHS = {}
+BASELINES = threading.local()
+#Distinct payloads kept by check_deduplicated
+MAX_PAYLOADS = 65536
+#Performance data values kept for exact quantiles, see StreamingStats
+MAX_PERF_VALUES = 65536
+#Results per compressed record of a Snapshot
+SNAPSHOT_BLOCK = 256
+#Probe metadata, see ProbeIndex
+PROBE_INDEX = None
+#Timings of the check run by each thread and where they are sent
+PHASES = threading.local()
+TIMINGS_SINK = None
+#Process pool checking chunks of SHARD_SIZE results, see --processes
+SHARD_POOL = None
+SHARD_SIZE = 2000
+#Subcommands which are not measurement types
+RUN_MODES = ('server', 'batch', 'index', 'poll', 'stream')
+#Global options configuring what all checks of a process share, checks
+#run by a server or from definitions can't change them, see configure
+SHARED_OPTIONS = ('api_url', 'connect_timeout', 'read_timeout', 'retries',
+        'cache_dir', 'cache_ttl', 'cache_max_size', 'cache_stale',
+        'rate_limit', 'rate_burst', 'rate_lock', 'probe_index',
+        'timings_statsd', 'timings_file', 'timings_prefix', 'processes',
+        'shard_size')
+CONFIGURED = None
+
+
+class CheckError(Exception):
+    """A check could not be run, reported to nagios as UNKNOWN"""
 
 
 def ensure_list(list_please):
@@ -14,130 +133,2049 @@ def ensure_list(list_please):
     else:
         return list_please
 
-def get_response(url):
-    '''Fetch a Json Object from url'''
-    headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-            }
-    try:
-        request = requests.get(url,headers=headers)
-        request.raise_for_status()
-    except requests.exceptions.RequestException as error:
-        print '''Unknown: Fatal error when reading request: %s''' % error
-        sys.exit(3)
-
-    if request.status_code in [200, 201, 202]:
-        return request.json()
-    else:
-        print '''Unexpected non-fatal status code: %s''' % request.status_code
-        sys.exit(3)
 
-def get_measurements(measurement_id):
-    '''Fetch a measuerment with it=measurement_id'''
-    url = "https://atlas.ripe.net/api/v1/measurement/%s/latest/" \
-            % measurement_id
-    return get_response(url)
+def iter_json_array(chunks):
+    """
+    Decode the elements of a top level json array one at a time
+    chunks is an iterable of strings holding the array, only the element
+    being decoded is held in memory
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    started = False
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('expected a json array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break
+            if not isinstance(element, (list, dict, basestring)) and (
+                    end == len(buf) or buf[end] not in ' \t\r\n,]'):
+                #a number could continue in the next chunk, as in 12|.5
+                break
+            yield element
+            pos = end
+        buf = buf[pos:]
+    raise ValueError('truncated json array')
+
+
+class CTime(float):
+    """A unix time printed as time.ctime, formatted only when printed"""
+
+    def __str__(self):
+        """Return the ctime string"""
+        return time.ctime(self)
+
+
+class lazy_property(object):
+    """
+    Decorator for an attribute computed on first access
+    the value is then memoized in the instance, so payload fields a check
+    never reads are never parsed
+    """
+
+    def __init__(self, function):
+        """Wrap function, called with the instance to compute the value"""
+        self.function = function
+        self.__name__ = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        """Compute the value and store it on instance"""
+        if instance is None:
+            return self
+        value = self.function(instance)
+        instance.__dict__[self.__name__] = value
+        return value
+
+
+class CacheEntry:
+    """A response read back from the ResponseCache"""
+
+    def __init__(self, meta, cached, mtime):
+        """
+        Initiate the entry, cached is the open cache file positioned at the
+        start of the body and mtime is when the body was last validated
+        """
+        self.meta = meta
+        self.cached = cached
+        self.age = time.time() - mtime
+
+    def chunks(self):
+        """Iterate over the body"""
+        try:
+            while True:
+                chunk = self.cached.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.cached.close()
+
+    def conditional_headers(self):
+        """Headers to revalidate the entry with the api"""
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+
+class ResponseCache:
+    """
+    On disk cache of api responses, safe to share between processes
+    Each url is stored in its own file, a json header line followed by the
+    raw body. Files are replaced atomically and the file mtime records when
+    the body was last validated against the api.
+    """
+
+    def __init__(self, path, ttl=60, max_size=64 * 1024 * 1024, stale=0):
+        """
+        Initiate the cache in directory path
+        ttl is the number of seconds an entry is used without revalidation,
+        stale the number of seconds an entry may still be used when the api
+        fails and max_size the number of bytes kept on disk
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale = stale
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+    def filename(self, url):
+        """Return the file caching url"""
+        return os.path.join(self.path,
+                hashlib.sha1(url).hexdigest() + '.cache')
+
+    def load(self, url):
+        """Return the CacheEntry for url or None"""
+        try:
+            cached = open(self.filename(url), 'rb')
+        except IOError:
+            return None
+        try:
+            mtime = os.fstat(cached.fileno()).st_mtime
+            meta = json.loads(cached.readline())
+        except (IOError, OSError, ValueError):
+            cached.close()
+            return None
+        if meta.get('url') != url:
+            cached.close()
+            return None
+        return CacheEntry(meta, cached, mtime)
+
+    def touch(self, url):
+        """Mark the entry for url as just validated"""
+        try:
+            os.utime(self.filename(url), None)
+        except OSError:
+            pass
+
+    def store(self, url, response, chunks):
+        """
+        Store the body of response for url while iterating over it
+        chunks iterates over the body, the entry only replaces the previous
+        one once the whole body has been read
+        """
+        meta = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                }
+        handle, tmp_name = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        stored = False
+        try:
+            with os.fdopen(handle, 'wb') as cached:
+                cached.write(json.dumps(meta) + '\n')
+                for chunk in chunks:
+                    cached.write(chunk)
+                    yield chunk
+            os.rename(tmp_name, self.filename(url))
+            stored = True
+        finally:
+            if not stored:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently validated entries above max_size"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith('.cache'):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class RateLimiter:
+    """
+    Token bucket limiting requests to rate per second, in bursts of burst
+    with path the bucket is kept in that file and shared, under an
+    exclusive lock, by every process using it
+    """
+
+    def __init__(self, rate, burst=None, path=None):
+        """Initiate a full bucket"""
+        self.rate = float(rate)
+        self.burst = max(1, burst or rate)
+        self.path = path
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def reserve(self, tokens, last):
+        """
+        Take a token from a bucket holding tokens at time last
+        returns (tokens, last) after taking it and the seconds to wait,
+        tokens go negative while requests are waiting for their token
+        """
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+        return tokens, now, max(0, -tokens / self.rate)
+
+    def take(self):
+        """Take a token, return the seconds to wait before using it"""
+        with self.lock:
+            if self.path is None:
+                self.tokens, self.last, wait = self.reserve(self.tokens,
+                        self.last)
+                return wait
+            handle = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    tokens, last = [float(field)
+                            for field in os.read(handle, 64).split()]
+                except ValueError:
+                    tokens, last = self.burst, time.time()
+                tokens, last, wait = self.reserve(tokens, last)
+                os.lseek(handle, 0, os.SEEK_SET)
+                os.ftruncate(handle, 0)
+                os.write(handle, "%f %f" % (tokens, last))
+            finally:
+                os.close(handle)
+            return wait
+
+    def acquire(self):
+        """Wait until a request may be made"""
+        wait = self.take()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SingleFlight:
+    """Share one call between the threads making it at the same time"""
+
+    def __init__(self):
+        """Initiate without calls in flight"""
+        self.lock = threading.Lock()
+        #key: [done event, result, exception]
+        self.calls = {}
+
+    def call(self, key, function, *args):
+        """
+        Return function(*args), unless a call with key is already in
+        flight, then wait for it and return its result or raise its error
+        """
+        with self.lock:
+            flight = self.calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.calls[key] = [threading.Event(), None, None]
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+        try:
+            flight[1] = function(*args)
+        except Exception as error:
+            flight[2] = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            flight[0].set()
+        return flight[1]
+
+
+class AtlasClient:
+    """
+    Client for the ripe atlas api
+    keep-alive connections are pooled and reused between requests, GETs
+    are bounded by connect/read timeouts and retried with jittered backoff
+    """
+    retry_status = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url=API_URL, connect_timeout=5, read_timeout=30,
+            retries=2, backoff=0.5, pool_size=10, cache=None, limiter=None):
+        """
+        Initiate the client and its connection pool
+        cache is an optional ResponseCache used by get_json, limiter an
+        optional RateLimiter every request waits for
+        """
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.limiter = limiter
+        #concurrent get_json calls of the same url share one request
+        self.flights = SingleFlight()
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+                'Content-Type': 'application/json',
+                'Accept': 'application/json',
+                'Accept-Encoding': 'gzip, deflate',
+                })
+
+    def url(self, *path, **params):
+        """Build the api url for path with the query string params"""
+        url = '%s/%s/' % (self.base_url,
+                '/'.join(str(part) for part in path))
+        if params:
+            url += '?' + urllib.urlencode(sorted(params.items()))
+        return url
+
+    def sleep(self, attempt, response=None):
+        """
+        Wait before retrying, honour Retry-After on throttled requests
+        a Retry-After longer than the read timeout raises CheckError
+        rather than holding the check that long
+        """
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if response is not None:
+            try:
+                retry_after = int(response.headers['Retry-After'])
+            except (KeyError, ValueError):
+                retry_after = 0
+            if retry_after > self.timeout[1]:
+                raise CheckError("Unknown: The api answered %s, retry "
+                        "after %s seconds" % (response.status_code,
+                        retry_after))
+            delay = max(delay, retry_after)
+        time.sleep(delay)
+
+    def get(self, url, headers=None, stream=False):
+        """
+        GET url, retrying transient failures, returns the response
+        with stream the body is left to be read with iter_body
+        """
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                response = self.session.get(url, headers=headers,
+                        timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as error:
+                if attempt >= self.retries:
+                    raise CheckError(FETCH_ERROR % error)
+                self.sleep(attempt)
+            except requests.exceptions.RequestException as error:
+                raise CheckError(FETCH_ERROR % error)
+            else:
+                #time to the response headers, it is also part of the
+                #fetch phase
+                timings = current_timings()
+                if timings is not None:
+                    timings.add('api', response.elapsed.total_seconds())
+                if response.status_code not in self.retry_status or \
+                        attempt >= self.retries:
+                    return response
+                self.sleep(attempt, response)
+            attempt += 1
+
+    @staticmethod
+    def check_response(request):
+        """Raise CheckError unless request holds a usable answer"""
+        try:
+            request.raise_for_status()
+        except requests.exceptions.RequestException as error:
+            raise CheckError(FETCH_ERROR % error)
+
+        if request.status_code not in [200, 201, 202]:
+            raise CheckError('''Unexpected non-fatal status code: %s''' % \
+                    request.status_code)
+
+    @staticmethod
+    def iter_body(request):
+        """Iterate over the body of request in chunks"""
+        try:
+            for chunk in request.iter_content(CHUNK_SIZE):
+                yield chunk
+        except requests.exceptions.RequestException as error:
+            raise CheckError(FETCH_ERROR % error)
+
+    def get_chunks(self, url, stream=False):
+        """Fetch url, return an iterator over the body"""
+        if self.cache is not None:
+            return self.get_cached(url, stream)
+        request = self.get(url, stream=stream)
+        self.check_response(request)
+        return self.iter_body(request)
+
+    def get_json(self, url):
+        """
+        Fetch a Json Object from url
+        threads fetching the same url at the same time share the request
+        """
+        return self.flights.call(url, self.fetch_json, url)
+
+    def fetch_json(self, url):
+        """Fetch a Json Object from url"""
+        if self.cache is not None:
+            body = ''.join(self.get_cached(url))
+            with phase_timer('decode'):
+                return json.loads(body)
+        request = self.get(url)
+        self.check_response(request)
+        with phase_timer('decode'):
+            return request.json()
+
+    def iter_json(self, url):
+        """Fetch the Json array at url, yielding it element by element"""
+        try:
+            for element in iter_json_array(self.get_chunks(url, True)):
+                yield element
+        except ValueError as error:
+            raise CheckError('''Unknown: Invalid json in response: %s''' % \
+                    error)
+
+    def iter_stream(self, url):
+        """
+        Follow the json lines pushed at url until the server closes it
+        empty lines are keep-alives, they are yielded as None
+        """
+        request = self.get(url, stream=True)
+        self.check_response(request)
+        try:
+            for line in request.iter_lines():
+                yield json.loads(line) if line.strip() else None
+        except requests.exceptions.RequestException as error:
+            raise CheckError(FETCH_ERROR % error)
+        except ValueError as error:
+            raise CheckError('''Unknown: Invalid json in response: %s''' % \
+                    error)
+        finally:
+            request.close()
+
+    def get_cached(self, url, stream=False):
+        """
+        Return an iterator over the body of url from the cache
+        expired entries are revalidated with a conditional request, and
+        served stale if the api fails while they are recent enough
+        """
+        entry = self.cache.load(url)
+        if entry is not None and entry.age < self.cache.ttl:
+            return entry.chunks()
+        try:
+            request = self.get(url,
+                    entry.conditional_headers() if entry else None, stream)
+            if request.status_code == 304 and entry is not None:
+                self.cache.touch(url)
+                return entry.chunks()
+            self.check_response(request)
+        except CheckError:
+            if entry is not None and entry.age < self.cache.stale:
+                return entry.chunks()
+            raise
+        if entry is not None:
+            entry.cached.close()
+        return self.cache.store(url, request, self.iter_body(request))
+
+    def latest(self, measurement_id):
+        """Fetch the latest results of a measurement"""
+        return self.get_json(
+                self.url('measurement', measurement_id, 'latest'))
+
+    def iter_latest(self, measurement_id):
+        """Stream the latest results of a measurement probe by probe"""
+        return self.iter_json(
+                self.url('measurement', measurement_id, 'latest'))
+
+    def iter_results(self, measurement_id, start, stop, page=3600):
+        """
+        Stream the results of a measurement from start up to stop
+        the time range is fetched page seconds at a time
+        """
+        for page_start in xrange(int(start), int(stop), int(page)):
+            page_stop = min(page_start + int(page), int(stop))
+            for result in self.iter_json(self.url('measurement',
+                    measurement_id, 'result', start=page_start,
+                    stop=page_stop - 1)):
+                yield result
+
+
+def get_client():
+    """Return the shared api client, creating it on first use"""
+    global CLIENT
+    if CLIENT is None:
+        CLIENT = AtlasClient()
+    return CLIENT
+
+
+def configure_client(args):
+    """Replace the shared api client with one configured from args"""
+    global CLIENT
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl,
+                max_size=args.cache_max_size * 1024 * 1024,
+                stale=args.cache_stale)
+    limiter = None
+    if args.rate_limit:
+        limiter = RateLimiter(args.rate_limit, args.rate_burst,
+                args.rate_lock)
+    CLIENT = AtlasClient(args.api_url,
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout,
+            retries=args.retries,
+            pool_size=max(10, getattr(args, 'workers', 0)),
+            cache=cache,
+            limiter=limiter)
+    return CLIENT
+
+
+def get_response(url):
+    '''Fetch a Json Object from url'''
+    return get_client().get_json(url)
+
+def get_measurements(measurement_id, stream=False):
+    '''
+    Fetch a measuerment with it=measurement_id
+    with stream the probe results are decoded and returned one at a time
+    '''
+    if stream:
+        return get_client().iter_latest(measurement_id)
+    return get_client().latest(measurement_id)
+
+
+class WindowState:
+    """
+    Results of a measurement window kept between runs in a state file
+    the first line holds the last fetched time, then one [time, result]
+    per line. the time is the timestamp of the result, or when it was
+    fetched for results without data
+    """
+
+    def __init__(self, path, measurement_id, window):
+        """Initiate the state of the window of measurement_id"""
+        self.filename = os.path.join(path, "%s-%d.window" % (
+                measurement_id, window))
+        self.path = path
+        self.last = None
+
+    def load(self, start):
+        """Return the stored (time, result) not older than start"""
+        entries = []
+        try:
+            state = open(self.filename)
+        except IOError:
+            return entries
+        with state:
+            try:
+                self.last = json.loads(state.readline())['last']
+                for line in state:
+                    when, result = json.loads(line)
+                    if when >= start:
+                        entries.append((when, result))
+            except (ValueError, KeyError, TypeError, IndexError):
+                self.last = None
+                return []
+        return entries
+
+    def save(self, entries, last):
+        """Replace the state with the (time, result) fetched up to last"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        handle, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(handle, 'w') as state:
+            state.write(json.dumps({'last': last}) + '\n')
+            for entry in entries:
+                state.write(json.dumps(entry) + '\n')
+        os.rename(temp, self.filename)
+
+
+def get_window(measurement_id, window, page=3600, state_dir=None,
+        late=900):
+    '''
+    Fetch the results of the last window seconds of a measuerment
+    without state_dir the results are an iterator over the pages as they
+    are fetched, with it only the results since late seconds before the
+    last run are fetched, probes upload their results late. the results
+    fetched again are kept once per probe and timestamp
+    '''
+    stop = int(time.time()) + 1
+    start = stop - window
+    if state_dir is None:
+        return get_client().iter_results(measurement_id, start, stop, page)
+    state = WindowState(state_dir, measurement_id, window)
+    entries = state.load(start)
+    if state.last is not None:
+        start = max(start, state.last - late)
+    seen = set((result[1], result[5] and result[5][1])
+            for _, result in entries)
+    for result in get_client().iter_results(measurement_id, start, stop,
+            page):
+        key = (result[1], result[5] and result[5][1])
+        if key in seen:
+            continue
+        seen.add(key)
+        entries.append((stop if result[5] is None else result[5][1],
+                result))
+    try:
+        state.save(entries, stop)
+    except (IOError, OSError):
+        pass
+    return [result for _, result in entries]
+
+
+class Snapshot:
+    """
+    Probe results saved in a compact file, to check them again offline
+    the file is a magic line followed by records of a 4 byte length and
+    zlib compressed json, the first record is the metadata, the others
+    arrays of up to SNAPSHOT_BLOCK results. the file is memory mapped and
+    decoded a record at a time
+    """
+    magic = 'ATLASNAP1\n'
+
+    def __init__(self, path):
+        """Initiate the snapshot at path"""
+        self.path = path
+
+    @staticmethod
+    def write_record(snapshot, value):
+        """Compress value and write it with its length"""
+        data = zlib.compress(json.dumps(value, separators=(',', ':')))
+        snapshot.write(struct.pack('>I', len(data)) + data)
+
+    def write(self, results, metadata):
+        """
+        Save results, yielding them as they are written
+        the snapshot only replaces path once results are exhausted, a
+        CheckError is raised if it can't be written
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temp = None
+        try:
+            handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as snapshot:
+                snapshot.write(self.magic)
+                self.write_record(snapshot, metadata)
+                block = []
+                for result in results:
+                    block.append(result)
+                    if len(block) >= SNAPSHOT_BLOCK:
+                        self.write_record(snapshot, block)
+                        block = []
+                    yield result
+                if block:
+                    self.write_record(snapshot, block)
+            os.rename(temp, self.path)
+        except (IOError, OSError) as error:
+            raise CheckError("Unknown: Can't write snapshot %s: %s" % (
+                    self.path, error))
+        finally:
+            if temp is not None and os.path.exists(temp):
+                os.unlink(temp)
+
+    def records(self):
+        """Yield the decoded records, the metadata first"""
+        try:
+            with open(self.path, 'rb') as snapshot:
+                data = mmap.mmap(snapshot.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+            try:
+                if data[:len(self.magic)] != self.magic:
+                    raise ValueError("not a snapshot")
+                offset = len(self.magic)
+                while offset < len(data):
+                    length, = struct.unpack_from('>I', data, offset)
+                    offset += 4
+                    yield json.loads(zlib.decompress(
+                            data[offset:offset + length]))
+                    offset += length
+            finally:
+                data.close()
+        except (IOError, ValueError, mmap.error, struct.error,
+                zlib.error) as error:
+            raise CheckError("Unknown: Invalid snapshot %s: %s" % (
+                    self.path, error))
+
+    def metadata(self):
+        """Return the metadata saved with the results"""
+        return next(self.records())
+
+    def results(self):
+        """Yield the saved results one by one"""
+        records = self.records()
+        next(records)
+        for block in records:
+            for result in block:
+                yield result
+
+
+def read_results(path):
+    """Yield the results of a json file saved from the api"""
+    try:
+        with open(path) as results:
+            for result in iter_json_array(iter(
+                    lambda: results.read(CHUNK_SIZE), '')):
+                yield result
+    except (IOError, ValueError) as error:
+        raise CheckError("Unknown: Invalid results file %s: %s" % (path,
+                error))
+
+
+def fetch_results(args):
+    '''
+    Fetch the measuerment results args checks, latest or a window
+    or read them from a results file or snapshot
+    '''
+    if args.from_snapshot:
+        return Snapshot(args.from_snapshot).results()
+    if args.from_file:
+        return read_results(args.from_file)
+    if args.window:
+        results = get_window(args.measurement_id, args.window,
+                args.window_page, args.window_state, args.window_late)
+    else:
+        results = get_measurements(args.measurement_id, args.stream)
+    if args.snapshot_dir:
+        now = time.time()
+        #the pid and microseconds keep fetches of the same measurement apart
+        results = Snapshot(os.path.join(args.snapshot_dir, '%s-%.6f-%d.snap'
+                % (args.measurement_id, now, os.getpid()))).write(results, {
+                'measurement_id': args.measurement_id,
+                'window': args.window,
+                'time': now,
+                })
+    return results
+
+
+class ProbeIndex:
+    """
+    Probe metadata (asn, country, status, anchor) kept in a sqlite file
+    the index is rebuilt in bulk by refresh, lookups never use the api
+    """
+    columns = ('asn_v4', 'asn_v6', 'country', 'status', 'is_anchor')
+
+    def __init__(self, path):
+        """Open the index at path, a missing index knows no probe"""
+        self.path = path
+        self.probes = {}
+        self.lock = threading.Lock()
+        self.db = None
+        if os.path.exists(path):
+            self.db = sqlite3.connect(path, check_same_thread=False)
+
+    def lookup(self, probe_id):
+        """Return the metadata of probe_id as a dict, None if unknown"""
+        try:
+            return self.probes[probe_id]
+        except KeyError:
+            pass
+        probe = None
+        if self.db is not None:
+            with self.lock:
+                row = self.db.execute('SELECT %s FROM probes WHERE id = ?'
+                        % ', '.join(self.columns), (probe_id,)).fetchone()
+            if row is not None:
+                probe = dict(zip(self.columns, row))
+        self.probes[probe_id] = probe
+        return probe
+
+    def group(self, probe_id, field):
+        """Return the name of the group of probe_id by field"""
+        probe = self.lookup(probe_id)
+        if probe is None or probe[field] is None:
+            return 'unknown'
+        if field.startswith('asn'):
+            return 'AS%s' % probe[field]
+        return probe[field]
+
+    def connected(self, measurements):
+        """Yield the results of probes which aren't known as disconnected"""
+        for measurement in measurements:
+            probe = self.lookup(measurement[1])
+            if probe is None or probe['status'] in (None, 'Connected'):
+                yield measurement
+
+    def refresh(self, client, page=500):
+        """Rebuild the index from all the probes known to the api"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(handle)
+        db = sqlite3.connect(temp)
+        try:
+            db.execute('CREATE TABLE probes (id INTEGER PRIMARY KEY, %s)'
+                    % ', '.join(self.columns))
+            url = client.url('probe', limit=page)
+            count = 0
+            while url:
+                response = client.get_json(url)
+                db.executemany('INSERT OR REPLACE INTO probes VALUES '
+                        '(?, ?, ?, ?, ?, ?)', [(probe['id'],
+                        probe.get('asn_v4'), probe.get('asn_v6'),
+                        probe.get('country_code'),
+                        probe.get('status_name'),
+                        bool(probe.get('is_anchor')))
+                        for probe in response['objects']])
+                count += len(response['objects'])
+                url = response['meta'].get('next')
+                if url:
+                    url = urlparse.urljoin(client.base_url, url)
+            db.commit()
+        except (KeyError, TypeError):
+            os.unlink(temp)
+            raise CheckError("Unknown: unexpected probe list from the api")
+        except:
+            os.unlink(temp)
+            raise
+        finally:
+            db.close()
+        os.rename(temp, self.path)
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.probes = {}
+        return count
+
+
+def get_probe_index():
+    """Return the shared probe index, None without --probe-index"""
+    return PROBE_INDEX
+
+
+def configure_probe_index(args):
+    """Open the probe index selected by args"""
+    global PROBE_INDEX
+    PROBE_INDEX = None
+    if args.probe_index:
+        PROBE_INDEX = ProbeIndex(args.probe_index)
+    return PROBE_INDEX
+
+
+def register_check_type(path, help, measurement):
+    '''
+    Register a check type run with the command line path, e.g. ('dns', 'A')
+    measurement is the Measurment subclass or its dotted name, which is
+    only imported when the check type is used
+    '''
+    CHECK_TYPES[tuple(path)] = [help, measurement]
+
+
+def register_check_group(name, help, title):
+    '''Register the command name grouping check types, e.g. dns'''
+    CHECK_GROUPS[name] = (help, title)
+
+
+def check_type(path):
+    '''Return the Measurment subclass registered for path'''
+    entry = CHECK_TYPES[path]
+    if isinstance(entry[1], basestring):
+        module, _, name = entry[1].rpartition('.')
+        entry[1] = getattr(importlib.import_module(module), name)
+    return entry[1]
+
+
+def measurement_class(measurement_type):
+    '''Return the Measurment subclass for measurement_type'''
+    for path in CHECK_TYPES:
+        if path[-1].lower() == measurement_type.lower():
+            return check_type(path)
+    return Measurment
+
+
+def parse_measurements(measurements, measurement_type, message):
+    '''
+    Parse the measuerment
+    measurements can be any iterable, parsed results are yielded one by
+    one so a streamed measurement is never held in memory as a whole
+    '''
+    parser = measurement_class(measurement_type)
+    for measurement in measurements:
+        probe_id = measurement[1]
+        if measurement[5] == None:
+            message.add_error(probe_id, "No data")
+            continue
+        yield parser(probe_id, measurement[5])
+
+
+def bind_check(method, *params):
+    '''
+    Bind the thresholds params to a check method
+    returns a function called with (measurement, message)
+    '''
+    def check(measurement, message):
+        '''Run the bound check'''
+        method(measurement, *(params + (message,)))
+    check.name = method.__name__
+    check.params = params
+    return check
+
+
+class CheckPlan:
+    """
+    The checks selected by the command line, compiled once per set of
+    arguments and applied to every probe result
+    """
+
+    def __init__(self, measurement_type, checks):
+        """Initiate the plan of measurement_type running checks in order"""
+        self.measurement_type = measurement_type
+        self.checks = tuple(checks)
+        #checks whose outcome depends on the time, not only the payload
+        volatile = measurement_class(measurement_type).volatile_checks
+        self.volatile = tuple(getattr(check, 'name', None) in volatile
+                for check in self.checks)
+        self.steps = tuple(zip(self.checks, self.volatile))
+
+    @staticmethod
+    def run_check(check, measurement, message, export):
+        """Run a check, passing its messages to export if it is set"""
+        if export is None:
+            check(measurement, message)
+            return None
+        recorder = OutcomeRecorder(message)
+        check(measurement, recorder)
+        export.write(check, measurement, recorder.messages)
+        return recorder.messages
+
+    def apply(self, measurement, message, export=None):
+        """
+        Run the plan against one parsed measurement
+        with an OutcomeExport the messages of each check are exported
+        """
+        message.open_result()
+        for check in self.checks:
+            self.run_check(check, measurement, message, export)
+        measurement.perfdata(message)
+        message.close_result()
+
+    def apply_recorded(self, measurement, message, export=None):
+        """
+        Run the plan against one parsed measurement
+        returns the outcome of the checks which aren't volatile, a list
+        of the (status, message, args) added by each of them
+        """
+        outcome = []
+        message.open_result()
+        for check, volatile in self.steps:
+            if volatile:
+                self.run_check(check, measurement, message, export)
+            else:
+                recorder = OutcomeRecorder(message)
+                check(measurement, recorder)
+                outcome.append(recorder.messages)
+                if export is not None:
+                    export.write(check, measurement, recorder.messages)
+        measurement.perfdata(message)
+        message.close_result()
+        return outcome
+
+    def apply_cached(self, measurement, message, outcome, export=None):
+        """
+        Run the plan against one parsed measurement, only running the
+        volatile checks and reusing outcome from apply_recorded for the
+        others
+        """
+        outcome = iter(outcome)
+        message.open_result()
+        for check, volatile in self.steps:
+            if volatile:
+                self.run_check(check, measurement, message, export)
+                continue
+            messages = next(outcome)
+            for status, text, args in messages:
+                message.add(status, measurement.probe_id, text, tuple(args))
+            if export is not None:
+                export.write(check, measurement, messages)
+        measurement.perfdata(message)
+        message.close_result()
+
+
+class OutcomeRecorder:
+    """Stand-in for a ProbeMessage recording the messages of a check"""
+
+    def __init__(self, message):
+        """Initiate the recorder passing the messages on to message"""
+        self.message = message
+        self.messages = []
+
+    def add(self, status, probe, message, args):
+        """Record and add a message"""
+        self.messages.append((status, message, args))
+        self.message.add(status, probe, message, args)
+
+    def add_error(self, probe, message, *args):
+        """Add an error message"""
+        self.add(2, probe, message, args)
+
+    def add_warn(self, probe, message, *args):
+        """Add an warn message"""
+        self.add(1, probe, message, args)
+
+    def add_ok(self, probe, message, *args):
+        """Add an ok message"""
+        self.add(0, probe, message, args)
+
+
+class CheckState:
+    """
+    Outcome of the checks of each probe result of the last run
+    kept in a state file per measurement and set of check arguments,
+    results seen before only run volatile checks. a result is identified
+    by its probe and timestamp, the payload isn't compared. identical
+    outcomes are stored once and referred to by their index
+    """
+
+    def __init__(self, path, args):
+        """Load the state of the check args from the directory path"""
+        key = hashlib.sha1(repr(sorted(vars(args).items()))).hexdigest()
+        self.path = path
+        self.filename = os.path.join(path, "%s-%s.state" % (
+                args.measurement_id, key[:16]))
+        #index in outcomes of the outcome of each result
+        self.previous = {}
+        self.current = {}
+        self.outcomes = []
+        self.indices = {}
+        try:
+            with open(self.filename) as state:
+                state = json.load(state)
+            self.outcomes = state['outcomes']
+            self.previous = state['results']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        for index, outcome in enumerate(self.outcomes):
+            self.indices[json.dumps(outcome)] = index
+
+    def apply(self, plan, measurement, message, export=None):
+        """Run plan against measurement, reusing the last outcome"""
+        key = "%s %s" % (measurement.probe_id, measurement.check_time)
+        index = self.previous.get(key)
+        if index is not None:
+            plan.apply_cached(measurement, message, self.outcomes[index],
+                    export)
+        else:
+            index = self.intern(plan.apply_recorded(measurement, message,
+                    export))
+        self.current[key] = index
+
+    def intern(self, outcome):
+        """Return the index of outcome in outcomes, adding it if it's new"""
+        key = json.dumps(outcome)
+        try:
+            return self.indices[key]
+        except KeyError:
+            self.indices[key] = len(self.outcomes)
+            self.outcomes.append(outcome)
+            return self.indices[key]
+
+    def save(self):
+        """
+        Replace the state file with the outcomes of this run, unless they
+        are those of the last run
+        """
+        if self.current == self.previous:
+            return
+        #drop the outcomes no result of this run has
+        used = sorted(set(self.current.itervalues()))
+        renumber = dict((index, number) for number, index in enumerate(used))
+        state = {
+            'outcomes': [self.outcomes[index] for index in used],
+            'results': dict((key, renumber[index])
+                    for key, index in self.current.iteritems()),
+            }
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            handle, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(handle, 'w') as output:
+                #dumps encodes in c, dump in python
+                output.write(json.dumps(state))
+            os.rename(temp, self.filename)
+        except (IOError, OSError):
+            pass
+
+
+def compile_plan(args):
+    '''
+    Compile args into a CheckPlan
+    plans are cached so batch and server runs reuse them between checks
+    '''
+    key = tuple(sorted(vars(args).items()))
+    try:
+        return PLANS[key]
+    except KeyError:
+        pass
+    except TypeError:
+        #unhashable argument values, don't cache
+        key = None
+    plan = CheckPlan(args.name,
+            measurement_class(args.name).compile_checks(args))
+    if key is not None:
+        if len(PLANS) >= MAX_PLANS:
+            PLANS.clear()
+        PLANS[key] = plan
+    return plan
+
+
+def check_measurements(measurements, args, message, state=None,
+        export=None):
+    '''
+    check the measuerment
+    args is a CheckPlan or the parsed arguments to compile one from, with
+    a CheckState unchanged results reuse their last outcome, with an
+    OutcomeExport the outcome of every check is exported
+    '''
+    if isinstance(args, CheckPlan):
+        plan = args
+    else:
+        plan = compile_plan(args)
+    if state is None:
+        for measurement in measurements:
+            plan.apply(measurement, message, export)
+    else:
+        for measurement in measurements:
+            state.apply(plan, measurement, message, export)
+        state.save()
+
+
+def outcome_values(params, text, args):
+    """
+    Return the (expected, measured) values of a check message
+    params are the thresholds bound to the check, None if unknown
+    """
+    if text.startswith("desierd (%s), real (%s)"):
+        return args[0], args[1]
+    expected = params[0] if len(params) == 1 else None
+    return expected, args[-1] if args else None
+
+
+class OutcomeExport:
+    """
+    Export of the outcome of each check of each probe result as json lines
+    lines are buffered and written as they are produced, to a file or a
+    fifo, or to files of at most rotate lines in a spool directory
+    """
+    buffer_size = 64 * 1024
+
+    def __init__(self, path, measurement_id, rotate=100000):
+        """Initiate the export of measurement_id to path"""
+        self.path = path
+        self.measurement_id = measurement_id
+        self.rotate = rotate
+        self.spool = os.path.isdir(path)
+        self.output = None
+        self.temp = None
+        self.lines = 0
+
+    def open(self):
+        """Open the file, a new hidden one in a spool directory"""
+        if self.spool:
+            handle, self.temp = tempfile.mkstemp(dir=self.path,
+                    prefix='.outcomes-', suffix='.ndjson')
+            self.output = os.fdopen(handle, 'w', self.buffer_size)
+        else:
+            self.output = open(self.path, 'a', self.buffer_size)
+
+    @staticmethod
+    def outcomes(check, measurement, messages):
+        """
+        Return the (name, expected, measured) of each message of a check
+        checks adding several messages name them with a
+        <check name>_outcomes method of the measurement
+        """
+        params = getattr(check, 'params', ())
+        describe = getattr(measurement, check.name + '_outcomes', None)
+        if describe is not None:
+            return describe(*(params + (messages,)))
+        name = check.name.replace('check_', '', 1)
+        #leading names bound to a check tell its variants apart
+        if len(params) > 1 and isinstance(params[0], basestring):
+            name += '_' + params[0]
+        return [(name,) + outcome_values(params, text, args)
+                for _, text, args in messages]
+
+    def write(self, check, measurement, messages):
+        """Export the (status, message, args) messages of a check"""
+        outcomes = self.outcomes(check, measurement, messages)
+        try:
+            if self.output is None:
+                self.open()
+            for (status, text, args), (name, expected, measured) in zip(
+                    messages, outcomes):
+                self.output.write(json.dumps({
+                    'measurement_id': self.measurement_id,
+                    'probe_id': measurement.probe_id,
+                    'timestamp': measurement.check_time,
+                    'check': name,
+                    'status': status,
+                    'expected': expected,
+                    'measured': measured,
+                    'message': text % tuple(args) if args else text,
+                    }, default=str) + '\n')
+                self.lines += 1
+            if self.spool and self.lines >= self.rotate:
+                self.close()
+        except (IOError, OSError) as error:
+            raise CheckError("Unknown: Can't export outcomes: %s" % error)
+
+    def close(self):
+        """Flush the lines, a spool file appears under its final name"""
+        if self.output is None:
+            return
+        self.output.close()
+        self.output = None
+        self.lines = 0
+        if self.spool:
+            directory, name = os.path.split(self.temp)
+            os.rename(self.temp, os.path.join(directory, name[1:]))
+
+
+def outcome_export(args):
+    """Return the OutcomeExport of args, None without --export"""
+    if args.export:
+        return OutcomeExport(args.export, args.measurement_id,
+                args.export_rotate)
+    return None
+
+
+def check_deduplicated(measurements, plan, message, export=None):
+    '''
+    Parse and check measurements, each distinct payload once
+    a result with the payload of an earlier one, but for the timestamp,
+    reuses its parsed result and the outcome of its checks, only the
+    volatile checks and the perfdata are run for each probe
+    '''
+    parser = measurement_class(plan.measurement_type)
+    distinct = {}
+    for measurement in measurements:
+        probe_id, payload = measurement[1], measurement[5]
+        if payload == None:
+            message.add_error(probe_id, "No data")
+            continue
+        key = parser.payload_key(payload)
+        try:
+            parsed, outcome = distinct[key]
+        except KeyError:
+            parsed = parser(probe_id, payload)
+            outcome = plan.apply_recorded(parsed, message, export)
+            if len(distinct) < MAX_PAYLOADS:
+                distinct[key] = (parsed, outcome)
+            continue
+        plan.apply_cached(parsed.for_probe(probe_id, payload), message,
+                outcome, export)
+
+
+def iter_shards(measurements, size):
+    """Yield lists of up to size results of measurements"""
+    measurements = iter(measurements)
+    while True:
+        shard = list(itertools.islice(measurements, size))
+        if not shard:
+            return
+        yield shard
+
+
+def check_shard(task):
+    """
+    Parse and check a shard of the results in a SHARD_POOL process
+    task is (args, results), returns the ShardMessage outcome
+    """
+    args, measurements = task
+    message = ShardMessage(args.verbose, args.window_tolerance)
+    plan = compile_plan(args)
+    if args.dedupe:
+        check_deduplicated(measurements, plan, message)
+    else:
+        check_measurements(parse_measurements(measurements,
+                plan.measurement_type, message), plan, message)
+    return message.outcome()
+
+
+def check_sharded(measurements, args, message):
+    """
+    Parse and check measurements in shards on the SHARD_POOL processes
+    the outcomes are merged into message in the order of the results, a
+    measurement fitting in a single shard is checked in this process
+    """
+    shards = iter_shards(measurements, SHARD_SIZE)
+    first = next(shards, None)
+    second = next(shards, None)
+    if second is None:
+        plan = compile_plan(args)
+        if args.dedupe:
+            check_deduplicated(first or [], plan, message)
+        else:
+            check_measurements(parse_measurements(first or [],
+                    plan.measurement_type, message), plan, message)
+        return
+    #shards are read in this thread, streamed results keep their timings
+    pending = [SHARD_POOL.apply_async(check_shard, ((args, shard),))
+            for shard in itertools.chain((first, second), shards)]
+    for result in pending:
+        message.merge(result.get())
+
+
+def configure_shards(args):
+    """
+    Start the process pool selected by args
+    it is started before any thread and reused by every check
+    """
+    global SHARD_POOL, SHARD_SIZE
+    SHARD_SIZE = max(1, args.shard_size)
+    if args.processes > 1 and SHARD_POOL is None:
+        SHARD_POOL = multiprocessing_pool.Pool(args.processes)
+    return SHARD_POOL
+
+
+class P2Quantile:
+    """
+    Streaming estimate of the quantile p with the P-square algorithm
+    only five markers are kept however many values are added
+    """
+
+    def __init__(self, p):
+        """Initiate the estimator for the quantile p, 0 < p < 1"""
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    @classmethod
+    def from_sorted(cls, p, values):
+        """
+        Return the estimator of the quantile p of at least five sorted
+        values, the markers start at their desired positions
+        """
+        estimator = cls(p)
+        last = len(values) - 1
+        estimator.desired = [1 + last * increment
+                for increment in estimator.increments]
+        positions = [int(round(desired)) for desired in estimator.desired]
+        for index in (1, 2, 3, 4):
+            positions[index] = max(positions[index],
+                    positions[index - 1] + 1)
+        estimator.positions = positions
+        estimator.heights = [values[position - 1] for position in positions]
+        return estimator
+
+    def add(self, value):
+        """Add a value"""
+        heights = self.heights
+        if len(heights) < 5:
+            bisect.insort(heights, value)
+            return
+        positions = self.positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value) - 1
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        for index in range(5):
+            self.desired[index] += self.increments[index]
+        for index in (1, 2, 3):
+            delta = self.desired[index] - positions[index]
+            if (delta >= 1 and positions[index + 1] - positions[index] > 1) \
+                    or (delta <= -1 and
+                            positions[index - 1] - positions[index] < -1):
+                step = 1 if delta > 0 else -1
+                height = self.parabolic(index, step)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    height = heights[index] + step * (
+                            heights[index + step] - heights[index]) / \
+                            float(positions[index + step] - positions[index])
+                heights[index] = height
+                positions[index] += step
+
+    def parabolic(self, index, step):
+        """Piecewise parabolic prediction of marker index moved by step"""
+        heights = self.heights
+        positions = self.positions
+        return heights[index] + step / float(
+                positions[index + 1] - positions[index - 1]) * (
+                (positions[index] - positions[index - 1] + step) *
+                (heights[index + 1] - heights[index]) /
+                float(positions[index + 1] - positions[index]) +
+                (positions[index + 1] - positions[index] - step) *
+                (heights[index] - heights[index - 1]) /
+                float(positions[index] - positions[index - 1]))
+
+    def value(self):
+        """Return the estimated quantile, None without values"""
+        if not self.heights:
+            return None
+        if len(self.heights) < 5 or self.positions[4] == 5:
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+
+class StreamingStats:
+    """
+    Count, min, max, mean and quantiles of values seen one at a time
+    the quantiles are exact up to MAX_PERF_VALUES values, beyond that
+    they are estimated with P2Quantile
+    """
+    quantiles = (50, 95, 99)
+
+    def __init__(self, uom=''):
+        """Initiate the statistics, uom is the nagios unit of the values"""
+        self.uom = uom
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        #values and numpy arrays of values while the quantiles are exact
+        self.values = []
+        self.arrays = []
+        self.estimators = None
+
+    def add(self, value):
+        """Add a value"""
+        self.count += 1
+        self.total += value
+        if self.estimators is None:
+            self.values.append(value)
+            if len(self.values) > MAX_PERF_VALUES:
+                self.estimate()
+            return
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        for _, estimator in self.estimators:
+            estimator.add(value)
+
+    def add_array(self, values):
+        """Add a numpy array of values"""
+        if not len(values):
+            return
+        if self.estimators is not None:
+            for value in values.tolist():
+                self.add(value)
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.arrays.append(values)
+        if self.count > MAX_PERF_VALUES:
+            self.estimate()
+
+    def exact(self):
+        """Return the values as a sorted list, None once estimated"""
+        if self.estimators is not None:
+            return None
+        if self.arrays:
+            self.values.extend(numpy.concatenate(self.arrays).tolist())
+            self.arrays = []
+        self.values.sort()
+        return self.values
+
+    def estimate(self):
+        """Switch from the exact values to the P2Quantile estimators"""
+        values = self.exact()
+        self.min = values[0]
+        self.max = values[-1]
+        self.estimators = [(quantile, P2Quantile.from_sorted(
+                quantile / 100.0, values)) for quantile in self.quantiles]
+        self.values = None
+
+    @staticmethod
+    def quantile(values, p):
+        """
+        Return the quantile p of sorted values, interpolated linearly
+        between the closest ranks like numpy.percentile
+        """
+        rank = p * (len(values) - 1)
+        below = int(rank)
+        if below + 1 >= len(values):
+            return values[below]
+        return values[below] + (rank - below) * (
+                values[below + 1] - values[below])
+
+    def statistics(self):
+        """Return the (name, value) of the statistics"""
+        if not self.count:
+            return []
+        names = ['p%d' % quantile for quantile in self.quantiles]
+        if self.estimators is not None:
+            minimum, maximum = self.min, self.max
+            quantiles = zip(names, [estimator.value()
+                    for _, estimator in self.estimators])
+        elif self.arrays:
+            values = numpy.concatenate(self.arrays +
+                    [numpy.array(self.values, dtype=float)])
+            minimum, maximum = float(values.min()), float(values.max())
+            quantiles = zip(names,
+                    numpy.percentile(values, self.quantiles).tolist())
+        else:
+            values = self.exact()
+            minimum, maximum = values[0], values[-1]
+            quantiles = zip(names, [self.quantile(values, quantile / 100.0)
+                    for quantile in self.quantiles])
+        return [('min', minimum), ('max', maximum),
+                ('mean', self.total / self.count)] + quantiles
+
+    def statistic(self, name):
+        """Return the statistic name, e.g. p95, None if it is unknown"""
+        return dict(self.statistics()).get(name)
+
+    def perfdata(self, label):
+        """Return the nagios performance data of the statistics"""
+        return ["%s_%s=%.6g%s" % (label, name, value, self.uom)
+                for name, value in self.statistics()]
+
+
+class Timings:
+    """
+    Seconds spent in each phase of a check
+    phases nest, the time of an inner phase isn't counted in the outer
+    one, so the phases add up to the time of the check
+    """
+
+    def __init__(self):
+        """Initiate empty timings"""
+        self.phases = {}
+        self.order = []
+        #[phase, start] of the phases being timed, innermost last
+        self.stack = []
+
+    def add(self, phase, seconds):
+        """Add seconds to phase"""
+        if phase not in self.phases:
+            self.phases[phase] = 0.0
+            self.order.append(phase)
+        self.phases[phase] += seconds
+
+    def start(self, phase):
+        """Start timing phase, pausing the enclosing phase"""
+        now = timeit.default_timer()
+        if self.stack:
+            outer = self.stack[-1]
+            self.add(outer[0], now - outer[1])
+        self.stack.append([phase, now])
+
+    def stop(self):
+        """Stop timing the innermost phase, resuming the enclosing one"""
+        now = timeit.default_timer()
+        phase, started = self.stack.pop()
+        self.add(phase, now - started)
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def iter_phase(self, phase, iterator):
+        """Iterate over iterator, timing the production of items as phase"""
+        iterator = iter(iterator)
+        while True:
+            self.start(phase)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def merge(self, other):
+        """Add the phases of the Timings other"""
+        for phase in other.order:
+            self.add(phase, other.phases[phase])
+
+    def perfdata(self):
+        """Return the nagios performance data of the phases"""
+        return " ".join("time_%s=%.6fs" % (phase, self.phases[phase])
+                for phase in self.order)
+
+
+class phase_timer(object):
+    """
+    Context manager timing a phase of the check of the current thread
+    it does nothing unless the check is timed, see current_timings
+    """
+
+    def __init__(self, phase):
+        """Initiate the timer of phase"""
+        self.phase = phase
+        self.timings = None
+
+    def __enter__(self):
+        """Start timing"""
+        self.timings = current_timings()
+        if self.timings is not None:
+            self.timings.start(self.phase)
+
+    def __exit__(self, *exc_info):
+        """Stop timing"""
+        if self.timings is not None:
+            self.timings.stop()
+
+
+def current_timings():
+    """Return the Timings of the check run by this thread, if timed"""
+    return getattr(PHASES, 'timings', None)
+
+
+def set_timings(timings):
+    """Time the checks of this thread with timings, None to stop"""
+    PHASES.timings = timings
+
+
+class TimingsSink:
+    """Send check timings as statsd udp packets and/or json lines"""
+
+    def __init__(self, statsd=None, path=None, prefix='atlas_nagios'):
+        """
+        Initiate the sink
+        statsd is a host:port address, path a file the lines are
+        appended to
+        """
+        self.address = None
+        if statsd:
+            host, _, port = statsd.rpartition(':')
+            self.address = (host or 'localhost', int(port))
+        self.path = path
+        self.prefix = prefix
+        self.lock = threading.Lock()
+
+    def send(self, name, timings, status):
+        """Send the timings of the check name which ended with status"""
+        if self.address is not None:
+            packet = "\n".join("%s.%s.%s:%.3f|ms" % (self.prefix, name,
+                    phase, timings.phases[phase] * 1000)
+                    for phase in timings.order)
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                udp.sendto(packet, self.address)
+            except socket.error:
+                pass
+            finally:
+                udp.close()
+        if self.path is not None:
+            line = json.dumps({'time': int(time.time()), 'check': name,
+                    'status': status, 'phases': timings.phases},
+                    sort_keys=True)
+            with self.lock:
+                try:
+                    with open(self.path, 'a') as timings_file:
+                        timings_file.write(line + '\n')
+                except IOError:
+                    pass
+
+
+def configure_timings(args):
+    """Create the sink of the timings selected by args"""
+    global TIMINGS_SINK
+    TIMINGS_SINK = None
+    if args.timings_statsd or args.timings_file:
+        TIMINGS_SINK = TimingsSink(args.timings_statsd, args.timings_file,
+                args.timings_prefix)
+    return TIMINGS_SINK
+
 
+def add_perfdata(output, perfdata):
+    """Append perfdata to the performance data of a nagios output"""
+    lines = output.split("\n", 1)
+    lines[0] += (" " if " | " in lines[0] else " | ") + perfdata
+    return "\n".join(lines)
 
-def parse_measurements(measurements, measurement_type, message):
-    '''Parse the measuerment'''
-    parsed_measurements = []
-    for measurement in measurements:
-        probe_id = measurement[1]
-        if measurement[5] == None:
-            message.add_error(probe_id, "No data")
-            continue
-        parsed_measurements.append(
-            {
-                'a': MeasurmentDnsA,
-                'aaaa': MeasurmentDnsAAAA,
-                'cname': MeasurmentDnsCNAME,
-                'ds': MeasurmentDnsDS,
-                'dnskey' : MeasurmentDnsDNSKEY,
-                'soa': MeasurmentDnsSOA,
-                'http': MeasurmentHTTP,
-                'ping': MeasurmentPing,
-                'ssl': MeasurmentSSL,
-            }.get(measurement_type, Measurment)(probe_id, measurement[5])
-        )
-        #parsed_measurements.append(MeasurmentSSL(probe_id, measurement[5]))
-    return parsed_measurements
-
-
-def check_measurements(measurements, args, message):
-    '''check the measuerment'''
-    for measurement in measurements:
-        measurement.check(args, message)
 
 class ProbeMessage:
-    """Object to store nagios messages"""
-    def __init__(self, verbose):
+    """
+    Object to aggregate nagios messages
+    Only counters and the worst status of each probe are kept, message
+    strings are stored unformatted and only when the verbosity will print
+    them. The status is decided by the probe and measurement thresholds.
+    """
+    names = ("OK", "WARN", "ERROR")
+
+    def __init__(self, verbose, warn_probes=1, crit_probes=1,
+            warn_results=None, crit_results=None, tolerance=0, limits=(),
+            group=None, warn_groups=None, crit_groups=None):
         """
         Initialise Object
         verbose is an interger indicating how Much information to return
+        the status is WARN/ERROR when at least warn_probes/crit_probes
+        probes or, if they are set, warn_results/crit_results measurement
+        results have a warn/error condition. errors count as warn
+        conditions
+        a probe only has a condition when more than the tolerance
+        fraction of its results have it. limits are (label, statistic,
+        limit) performance data values that are an ERROR above limit
+        group maps a probe to its group name, e.g. its asn, the status is
+        also WARN/ERROR when warn_groups/crit_groups groups have probes
+        with a warn/error condition
         """
-        #need to group these by probe id
-        self.error = dict()
-        self.warn = dict()
-        self.ok = dict()
-        self.verbose = verbose
+        self.verbose = verbose or 0
+        self.warn_probes = max(1, warn_probes)
+        self.crit_probes = max(1, crit_probes)
+        self.warn_results = warn_results and max(1, warn_results)
+        self.crit_results = crit_results and max(1, crit_results)
+        #worst status of each probe
+        self.probes = {}
+        #results per status of each probe, only kept with a tolerance
+        self.tolerance = tolerance
+        self.samples = {}
+        self.limits = limits
+        self.group = group
+        self.warn_groups = warn_groups and max(1, warn_groups)
+        self.crit_groups = crit_groups and max(1, crit_groups)
+        #number of measurement results and of check messages per status
+        self.results = [0, 0, 0]
+        self.checks = [0, 0, 0]
+        #worst status and probe of the result being checked
+        self.current = None
+        self.current_probe = None
+        #(message, args) per status, for verbose output
+        self.messages = ([], [], [])
+        #performance data, StreamingStats and counters by label
+        self.perf = {}
+        self.counters = {}
 
-    def add_error(self, probe, message):
-        """Add an error message"""
+    @classmethod
+    def from_args(cls, args):
+        """Create the ProbeMessage for the parsed arguments"""
+        group = None
+        if args.group_by:
+            index = get_probe_index()
+            if index is None:
+                raise CheckError("Unknown: --group-by needs --probe-index")
+            group = lambda probe: index.group(probe, args.group_by)
+        return cls(args.verbose, args.warn_probes, args.crit_probes,
+                args.warn_mesuerment, args.crit_mesuerment,
+                args.window_tolerance,
+                measurement_class(args.name).perf_limits(args),
+                group, args.warn_groups, args.crit_groups)
+
+    def open_result(self):
+        """Start collecting the checks of one measurement result"""
+        self.current = 0
+        self.current_probe = None
+
+    def close_result(self):
+        """Count the result opened with open_result with its worst status"""
+        self.results[self.current] += 1
+        if self.tolerance and self.current_probe is not None:
+            self.sample(self.current_probe, self.current)
+        self.current = None
+
+    def sample(self, probe, status):
+        """Count a result of status for probe"""
         try:
-            self.error[probe].append(message)
+            self.samples[probe][status] += 1
         except KeyError:
-            self.error[probe] = [message]
+            self.samples[probe] = [0, 0, 0]
+            self.samples[probe][status] += 1
+
+    def add(self, status, probe, message, args):
+        """
+        Add a message of status for probe
+        message is formatted with args only if it is printed, a message
+        added outside of open_result/close_result is a result of its own
+        """
+        self.checks[status] += 1
+        if self.probes.get(probe, -1) < status:
+            self.probes[probe] = status
+        if self.current is None:
+            self.results[status] += 1
+            if self.tolerance:
+                self.sample(probe, status)
+        else:
+            self.current_probe = probe
+            if status > self.current:
+                self.current = status
+        if self.keeps(status):
+            self.messages[status].append((message, args))
+
+    def keeps(self, status):
+        """Return whether messages of status are kept for the output"""
+        return self.verbose > 1 or (status and self.verbose > 0)
+
+    def add_results(self, probes, statuses, checks):
+        """
+        Count results checked at once, e.g. by the columnar engine
+        statuses are the worst status of the result of each of probes and
+        checks the number of check messages per status, the messages
+        themselves are added with add_message
+        """
+        for status, count in enumerate(checks):
+            self.checks[status] += count
+        for probe, status in itertools.izip(probes, statuses):
+            if self.probes.get(probe, -1) < status:
+                self.probes[probe] = status
+            self.results[status] += 1
+            if self.tolerance:
+                self.sample(probe, status)
+
+    def add_message(self, status, message, *args):
+        """Keep a message counted by add_results for the output"""
+        self.messages[status].append((message, args))
+
+    def add_error(self, probe, message, *args):
+        """Add an error message"""
+        self.add(2, probe, message, args)
 
-    def add_warn(self, probe, message):
+    def add_warn(self, probe, message, *args):
         """Add an warn message"""
-        try:
-            self.warn[probe].append(message)
-        except KeyError:
-            self.warn[probe] = [message]
+        self.add(1, probe, message, args)
 
-    def add_ok(self, probe, message):
+    def add_ok(self, probe, message, *args):
         """Add an ok message"""
+        self.add(0, probe, message, args)
+
+    def add_perf(self, label, value, uom=''):
+        """Add a value to the performance data label"""
         try:
-            self.ok[probe].append(message)
+            self.perf[label].add(value)
         except KeyError:
-            self.ok[probe] = [message]
+            self.perf[label] = StreamingStats(uom)
+            self.perf[label].add(value)
 
-    def exit(self):
-        """Parse the message and exit correctly for nagios"""
-        if len(self.error) > 0:
-            if self.verbose > 0:
-                print "ERROR: %d: %s" % (len(self.error),
-                        ", ".join(self.error))
-                if self.verbose > 1:
-                    print "WARN: %d: %s" % (len(self.warn),
-                            ", ".join(self.warn))
-                    print "OK: %d: %s" % (len(self.ok),
-                        ", ".join(self.ok))
+    def add_perf_array(self, label, values, uom=''):
+        """Add a numpy array of values to the performance data label"""
+        if label not in self.perf:
+            self.perf[label] = StreamingStats(uom)
+        self.perf[label].add_array(values)
 
+    def count_perf(self, label, count=1):
+        """Count count more occurrences of the performance data label"""
+        self.counters[label] = self.counters.get(label, 0) + count
+
+    def merge(self, outcome):
+        """
+        Add the outcome of a ShardMessage, shards must be merged in the
+        order of their results for the same output as checking them here
+        """
+        probes, samples, results, checks, messages, values, counters = \
+                outcome
+        for probe, status in probes.iteritems():
+            if self.probes.get(probe, -1) < status:
+                self.probes[probe] = status
+        for probe, counts in samples.iteritems():
+            for status, count in enumerate(counts):
+                self.samples.setdefault(probe, [0, 0, 0])[status] += count
+        for status in (0, 1, 2):
+            self.results[status] += results[status]
+            self.checks[status] += checks[status]
+            self.messages[status].extend(messages[status])
+        for label, (uom, label_values) in values.iteritems():
+            for value in label_values:
+                self.add_perf(label, value, uom)
+        for label, count in counters.iteritems():
+            self.counters[label] = self.counters.get(label, 0) + count
+
+    def perfdata(self, counts):
+        """Return the nagios performance data string"""
+        data = []
+        if self.probes:
+            data.append("probes_ok=%.6g%%" % (
+                    100.0 * counts[0] / len(self.probes)))
+        for label in sorted(self.perf):
+            data.extend(self.perf[label].perfdata(label))
+        for label in sorted(self.counters):
+            data.append("%s=%d" % (label, self.counters[label]))
+        return " ".join(data)
+
+    def probe_status(self, probe):
+        """Return the status of probe"""
+        if self.tolerance:
+            return self.tolerated(self.samples.get(probe))
+        return self.probes[probe]
+
+    def probe_counts(self):
+        """Return the number of probes per worst status"""
+        counts = [0, 0, 0]
+        if self.tolerance:
+            for probe in self.probes:
+                counts[self.probe_status(probe)] += 1
+            return counts
+        for status in self.probes.itervalues():
+            counts[status] += 1
+        return counts
+
+    def group_counts(self):
+        """Return the number of probes per worst status of each group"""
+        groups = {}
+        if self.group is None:
+            return groups
+        for probe in self.probes:
+            name = self.group(probe)
+            if name not in groups:
+                groups[name] = [0, 0, 0]
+            groups[name][self.probe_status(probe)] += 1
+        return groups
+
+    def tolerated(self, samples):
+        """Return the status of a probe from its results per status"""
+        if not samples:
+            return 0
+        allowed = self.tolerance * sum(samples)
+        if samples[2] > allowed:
+            return 2
+        if samples[1] + samples[2] > allowed:
+            return 1
+        return 0
+
+    def exceeded(self):
+        """Return the (label, statistic, value, limit) above their limit"""
+        exceeded = []
+        for label, statistic, limit in self.limits:
+            if label in self.perf:
+                value = self.perf[label].statistic(statistic)
+                if value is not None and value > limit:
+                    exceeded.append((label, statistic, value, limit))
+        return exceeded
+
+    def status(self, counts=None, groups=None):
+        """Return the nagios status"""
+        if counts is None:
+            counts = self.probe_counts()
+        if groups is None:
+            groups = self.group_counts()
+        if counts[2] >= self.crit_probes or (self.crit_results and \
+                self.results[2] >= self.crit_results) or self.exceeded():
+            return 2
+        if self.crit_groups and len([group for group in groups.itervalues()
+                if group[2]]) >= self.crit_groups:
+            return 2
+        if counts[2] + counts[1] >= self.warn_probes or (self.warn_results \
+                and self.results[2] + self.results[1] >= self.warn_results):
+            return 1
+        if self.warn_groups and len([group for group in groups.itervalues()
+                if group[1] or group[2]]) >= self.warn_groups:
+            return 1
+        return 0
+
+    def grouped_counts(self, groups):
+        """Format the groups with warn/error probes, worst first"""
+        failing = sorted((-(group[2] + group[1]), name)
+                for name, group in groups.iteritems() if group[1] or group[2])
+        return ", ".join("%s %d/%d" % (name, -failed, sum(groups[name]))
+                for failed, name in failing)
+
+    def grouped(self, status):
+        """Format the messages of status, identical ones once with a count"""
+        counts = {}
+        order = []
+        for message, args in self.messages[status]:
+            text = message % args if args else message
+            if text in counts:
+                counts[text] += 1
             else:
-                print "ERROR: %d" % len(self.error)
-            sys.exit(2)
-        elif len(self.warn) > 0:
-            if self.verbose > 0:
-                print "WARN: %d: %s" % (len(self.warn),
-                        ", ".join(self.warn))
-                if self.verbose > 1:
-                    print "OK: %d: %s" % (len(self.ok),
-                        ", ".join(self.ok))
-            else:
-                print "WARN: %d" % len(self.warn)
-            sys.exit(1)
+                counts[text] = 1
+                order.append(text)
+        return ", ".join(text if counts[text] == 1 else \
+                "%s x%d" % (text, counts[text]) for text in order)
+
+    def result(self):
+        """Parse the message, return the nagios (status, output)"""
+        counts = self.probe_counts()
+        groups = self.group_counts()
+        status = self.status(counts, groups)
+        if status == 1:
+            count = counts[1] + counts[2]
         else:
-            if self.verbose > 1:
-                print "OK: %d: %s" % (len(self.ok),
-                    ", ".join(self.ok))
-            else:
-                print "OK: %d" % len(self.ok)
-            sys.exit(0)
+            count = counts[status]
+        lines = ["%s: %d" % (self.names[status], count)]
+        if status and self.grouped_counts(groups):
+            lines[0] += " (%s)" % self.grouped_counts(groups)
+        for label, statistic, value, limit in self.exceeded():
+            lines[0] += ", %s %s %.6g above %.6g" % (label, statistic,
+                    value, limit)
+        perfdata = self.perfdata(counts)
+        if perfdata:
+            lines[0] += " | " + perfdata
+        if self.verbose > 0:
+            for level in (2, 1, 0):
+                if self.messages[level]:
+                    lines.append("%s: %d: %s" % (self.names[level],
+                            counts[level], self.grouped(level)))
+        return status, "\n".join(lines)
+
+    def exit(self):
+        """Parse the message and exit correctly for nagios"""
+        status, output = self.result()
+        print output
+        sys.exit(status)
 
 
+class ShardMessage(ProbeMessage):
+    """
+    ProbeMessage of a process checking a shard of the results
+    the performance data values are kept as they are, quantile estimates
+    can't be merged but the values can be added to the parent in order
+    """
+
+    def __init__(self, verbose, tolerance=0):
+        """Initialise Object, see ProbeMessage"""
+        ProbeMessage.__init__(self, verbose, tolerance=tolerance)
+        self.values = {}
+
+    def add_perf(self, label, value, uom=''):
+        """Keep a value of the performance data label"""
+        try:
+            self.values[label][1].append(value)
+        except KeyError:
+            self.values[label] = (uom, [value])
+
+    def outcome(self):
+        """Return the picklable outcome for ProbeMessage.merge"""
+        return (self.probes, self.samples, self.results, self.checks,
+                self.messages, self.values, self.counters)
+
 
 class Message:
     """Object to store nagios messages"""
@@ -198,8 +2236,94 @@ class Message:
             sys.exit(0)
 
 
+class ProbeColumns:
+    """
+    Probe results of a measurement loaded into numpy columns
+    thresholds are evaluated on whole columns instead of probe by probe
+    """
+
+    def __init__(self, measurements, measurement_class, message):
+        """
+        Load measurements, the value column holds what
+        measurement_class.column_value extracts from each payload
+        """
+        self.probe_ids = []
+        self.check_times = []
+        self.values = []
+        for measurement in measurements:
+            probe_id = measurement[1]
+            payload = measurement[5]
+            if payload == None:
+                message.add_error(probe_id, "No data")
+                continue
+            self.probe_ids.append(probe_id)
+            self.check_times.append(payload[1])
+            self.values.append(measurement_class.column_value(payload))
+        self.check_time = numpy.array(self.check_times, dtype=float)
+        try:
+            #None converts to nan
+            self.value = numpy.array(self.values, dtype=float)
+        except (TypeError, ValueError):
+            self.value = numpy.array([to_float(value)
+                    for value in self.values], dtype=float)
+
+    def report(self, outcomes, message):
+        """
+        Add the outcomes of all probes to message
+        outcomes is a list of (passed, describe) with passed a boolean mask
+        and describe(index) returning the message and its arguments for
+        the probe at index, it is only called for the messages printed
+        """
+        if not outcomes:
+            message.results[0] += len(self.probe_ids)
+            return
+        failed = numpy.zeros(len(self.probe_ids), dtype=bool)
+        checks = [0, 0, 0]
+        for passed, _ in outcomes:
+            failed |= ~passed
+            passes = int(numpy.count_nonzero(passed))
+            checks[0] += passes
+            checks[2] += len(passed) - passes
+        message.add_results(self.probe_ids,
+                numpy.where(failed, 2, 0).tolist(), checks)
+        if message.keeps(0):
+            described = xrange(len(self.probe_ids))
+        elif message.keeps(2):
+            described = numpy.flatnonzero(failed).tolist()
+        else:
+            return
+        for index in described:
+            for passed, describe in outcomes:
+                status = 0 if passed[index] else 2
+                if message.keeps(status):
+                    message.add_message(status, *describe(index))
+
+
+def to_float(value):
+    """Return value as a float, nan if it isn't a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def check_columnar(measurements, args, message):
+    """Check a ping or http measurement with the numpy engine"""
+    if not numpy.available():
+        raise CheckError("Unknown: --columnar needs numpy")
+    if args.export:
+        raise CheckError("Unknown: --export can't be used with --columnar")
+    columnar_class = measurement_class(args.name)
+    columns = ProbeColumns(measurements, columnar_class, message)
+    columns.report(columnar_class.check_columns(columns, args), message)
+    columnar_class.perf_columns(columns, message)
+
+
 class Measurment: 
     """Parent object for an atlas measurment"""
+    msg = "%s (%s)"
+    #checks whose outcome changes with the time, see CheckState
+    volatile_checks = ('check_measurement_age',)
 
     def __init__(self, probe_id, payload):    
         """Initiate generic message data""" 
@@ -208,6 +2332,26 @@ class Measurment:
         self.check_time = self.payload[1]
         self.msg = "%s (%s)" 
 
+    @staticmethod
+    def payload_key(payload):
+        """
+        Return the payload without its timestamp, see for_probe
+        results decoded from identical json have identical keys
+        """
+        return repr(payload[:1] + payload[2:])
+
+    def for_probe(self, probe_id, payload):
+        """
+        Return this result for another probe with a payload of the same
+        payload_key, what was parsed already is shared
+        """
+        fields = self.__dict__.copy()
+        fields['probe_id'] = probe_id
+        fields['payload'] = payload
+        fields['check_time'] = payload[1]
+        #the instance is made around the fields, __init__ isn't run
+        return types.InstanceType(self.__class__, fields)
+
     @staticmethod
     def add_args(parser):
         """add SSL arguments"""
@@ -216,60 +2360,179 @@ class Measurment:
         parser.add_argument("measurement_id",
                 help="Measuerment ID to check")
         parser.add_argument('-w', '--warn-probes', type=int, default=2,
-                help='WARN if # probes have a warn condition')
+                help='WARN if # probes have a warn or error condition, a '
+                'single probe with a warn condition is OK by default')
         parser.add_argument('-c', '--crit-probes', type=int, default=1,
-                help='ERROR if # probes have a warn condition')
-        parser.add_argument('-W', '--warn-mesuerment', type=int, default=2,
-                help='WARN if # mesuerment have a warn condition')
-        parser.add_argument('-C', '--crit-mesuerment', type=int, default=1,
-                help='ERROR if # mesuerment have a warn condition')
+                help='ERROR if # probes have an error condition')
+        parser.add_argument('-W', '--warn-mesuerment', type=int,
+                help='WARN if # mesuerment results have a warn or error '
+                'condition, off by default')
+        parser.add_argument('-C', '--crit-mesuerment', type=int,
+                help='ERROR if # mesuerment results have an error '
+                'condition, off by default')
         parser.add_argument('--max_measurement_age', type=int, default=3600,
                 help='The max age of a measuerment in unix time')
+        parser.add_argument('--window', type=int,
+                help='Check all results of the last # seconds, '
+                'not only the latest')
+        parser.add_argument('--window-page', type=int, default=3600,
+                help='Fetch the window # seconds of results at a time')
+        parser.add_argument('--window-state',
+                help='Keep the window results in this directory and only '
+                'fetch the new ones on each run')
+        parser.add_argument('--window-late', type=int, default=900,
+                help='With --window-state fetch the results of # seconds '
+                'before the last run again, probes upload them late')
+        parser.add_argument('--window-tolerance', type=float, default=0,
+                help='A probe only has a condition if more than this '
+                'fraction of its results have it')
+        parser.add_argument('--group-by',
+                choices=('asn_v4', 'asn_v6', 'country'),
+                help='Group failing probes with the probe index')
+        parser.add_argument('--warn-groups', type=int,
+                help='WARN if # groups have probes with a warn condition')
+        parser.add_argument('--crit-groups', type=int,
+                help='ERROR if # groups have probes with an error condition')
+        parser.add_argument('--skip-disconnected', action='store_true',
+                help='Ignore probes the probe index knows as disconnected')
+        parser.add_argument('--state-dir',
+                help='Keep the outcome of each probe result in this '
+                'directory and only check results which changed')
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument('--from-file',
+                help='Check the results in this json file, e.g. saved '
+                'latest results, instead of fetching them')
+        source.add_argument('--from-snapshot',
+                help='Check the results of this snapshot instead of '
+                'fetching them')
+        parser.add_argument('--snapshot-dir',
+                help='Save the fetched results to a snapshot in this '
+                'directory')
+        parser.add_argument('--dedupe', action='store_true',
+                help='Parse and check identical payloads of different '
+                'probes once')
+        parser.add_argument('--export',
+                help='Write the outcome of each check of each probe as a '
+                'json line to this file, fifo or spool directory')
+        parser.add_argument('--export-rotate', type=int, default=100000,
+                help='Lines per file written to an export spool directory')
 
     def check_measurement_age(self, max_age, message):
         """Check if a measerment is fresh enough"""
         min_time = time.time() - max_age
-        check_time_str = time.ctime(self.check_time)
+        check_time_str = CTime(self.check_time)
         if self.check_time < min_time:
-            message.add_error(self.probe_id, self.msg % \
-                    ("measurement to old", check_time_str))
+            message.add_error(self.probe_id, self.msg,
+                    "measurement to old", check_time_str)
         else:
-            message.add_ok(self.probe_id, self.msg % \
-                    ("measurement fresh", check_time_str))
+            message.add_ok(self.probe_id, self.msg,
+                    "measurement fresh", check_time_str)
+
+    def check_measurement_age_outcomes(self, max_age, messages):
+        """
+        Return the (name, expected, measured) of check_measurement_age
+        the measured value is the age in seconds, like max_age
+        """
+        return [('measurement_age', max_age,
+                round(time.time() - self.check_time, 3))]
 
     def check_string(self, check_string, measurment_string, 
             check_type, message):
         """Generic check to compare two strings"""
         if check_string == measurment_string:
-            message.add_ok(self.probe_id, self.msg % \
-                    (check_type, measurment_string))
+            message.add_ok(self.probe_id, self.msg,
+                    check_type, measurment_string)
         else:
-            message.add_error(self.probe_id, self.msg % \
-                     (check_type, measurment_string))
+            message.add_error(self.probe_id, self.msg,
+                    check_type, measurment_string)
+
+    def perfdata(self, message):
+        """Add the performance data of the result to message"""
+        message.add_perf('age', time.time() - self.check_time, 's')
+
+    @staticmethod
+    def perf_columns(columns, message):
+        """Add the performance data of ProbeColumns to message"""
+        message.add_perf_array('age', time.time() - columns.check_time, 's')
+
+    @staticmethod
+    def perf_limits(args):
+        """Return the (label, statistic, limit) performance data limits"""
+        return ()
+
+    @classmethod
+    def compile_checks(cls, args):
+        """
+        Return the checks selected by args
+        as a list of functions called with (measurement, message)
+        """
+        checks = []
+        if args.max_measurement_age != False:
+            checks.append(bind_check(cls.check_measurement_age,
+                    args.max_measurement_age))
+        return checks
 
     def check(self, args, message):             
         """main check fucntion"""
+        for check in self.compile_checks(args):
+            check(self, message)
+
+    @classmethod
+    def check_columns(cls, columns, args):
+        """
+        main check function for the columnar engine
+        returns the (passed, describe) outcomes for ProbeColumns.report
+        """
+        outcomes = []
         if args.max_measurement_age != False:
-            self.check_measurement_age(
-                    args.max_measurement_age, message)
+            fresh = columns.check_time >= \
+                    time.time() - args.max_measurement_age
+            outcomes.append((fresh, lambda index: (cls.msg,
+                    "measurement fresh" if fresh[index] \
+                            else "measurement to old",
+                    CTime(columns.check_times[index]))))
+        return outcomes
 
 
 class MeasurmentSSL(Measurment):
     """Object for an atlas SSL Measurment"""
+    volatile_checks = Measurment.volatile_checks + ('check_expiry',)
 
     def __init__(self, probe_id, payload):
         """Initiate object"""
         #super(Measurment, self).__init__(payload)
         Measurment.__init__(self, probe_id, payload)
-        self.common_name = self.payload[2][0][0]
-        self.expiry = time.mktime(
+
+    @staticmethod
+    def payload_key(payload):
+        """
+        Return the sha1 hash of the certificate, identical certificates
+        have identical fields, see Measurment.payload_key
+        """
+        try:
+            return payload[2][0][5]
+        except (IndexError, KeyError, TypeError):
+            return Measurment.payload_key(payload)
+
+    @lazy_property
+    def common_name(self):
+        """The common name of the certificate"""
+        return self.payload[2][0][0]
+
+    @lazy_property
+    def expiry(self):
+        """The expiry time of the certificate"""
+        return time.mktime(
                 time.strptime(self.payload[2][0][4],"%Y%m%d%H%M%SZ"))
-        self.sha1 = self.payload[2][0][5]
+
+    @lazy_property
+    def sha1(self):
+        """The sha1 hash of the certificate"""
+        return self.payload[2][0][5]
 
     @staticmethod
-    def add_args(subparser):
+    def add_args(parser):
         """add SSL arguments"""
-        parser = subparser.add_parser('ssl', help='SSL check')
         Measurment.add_args(parser)
         parser.add_argument('--common_name',
                 help='Ensure a cert has this cn')
@@ -281,29 +2544,48 @@ class MeasurmentSSL(Measurment):
     def check_expiry(self, warn_expiry, message):
         """Check if the certificat is going to expire before warn_expiry"""
         current_time = time.time()
-        warn_time = current_time - (warn_expiry * 60 * 60 * 24)
-        expiry_str = time.ctime(self.expiry)
+        warn_time = current_time + (warn_expiry * 60 * 60 * 24)
+        expiry_str = CTime(self.expiry)
         if self.expiry < current_time:
-            message.add_error(self.probe_id, self.msg % (
-                    "certificate expierd", expiry_str))
+            message.add_error(self.probe_id, self.msg,
+                    "certificate expierd", expiry_str)
         elif self.expiry < warn_time:
-            message.add_warn(self.probe_id, self.msg % (
-                    "certificate expires soon", expiry_str))
+            message.add_warn(self.probe_id, self.msg,
+                    "certificate expires soon", expiry_str)
         else:
-            message.add_ok(self.probe_id, self.msg % (
-                    "certificate expiry good", expiry_str))
+            message.add_ok(self.probe_id, self.msg,
+                    "certificate expiry good", expiry_str)
 
-    def check(self, args, message):
-        """Main SSL check routine"""
-        Measurment.check(self, args, message)
+    def perfdata(self, message):
+        """
+        Add the performance data of the result to message
+        the expiry only once check_expiry parsed it, see --sslexpiry
+        """
+        Measurment.perfdata(self, message)
+        if 'expiry' in self.__dict__:
+            message.add_perf('expiry_days',
+                    (self.expiry - time.time()) / (60 * 60 * 24))
+
+    def check_sha1(self, sha1hash, message):
+        """Check the certificate has the sha1 hash sha1hash"""
+        self.check_string(sha1hash, self.sha1, 'sha1hash', message)
+
+    def check_common_name(self, common_name, message):
+        """Check the certificate has the common name common_name"""
+        self.check_string(common_name, self.common_name, 'cn', message)
+
+    @classmethod
+    def compile_checks(cls, args):
+        """Return the SSL checks selected by args"""
+        checks = Measurment.compile_checks(args)
         if args.sha1hash:
-            self.check_string( args.sha1hash, 
-                    self.sha1, 'sha1hash', message)
+            checks.append(bind_check(cls.check_sha1, args.sha1hash))
         if args.common_name:
-            self.check_string( args.common_name, 
-                    self.common_name, 'cn', message)
+            checks.append(bind_check(cls.check_common_name,
+                    args.common_name))
         if args.sslexpiry:
-            self.check_expiry(args.sslexpiry, message)
+            checks.append(bind_check(cls.check_expiry, args.sslexpiry))
+        return checks
 
 
 class MeasurmentPing(Measurment):
@@ -313,40 +2595,81 @@ class MeasurmentPing(Measurment):
         """Initiate object"""
         #super(Measurment, self).__init__(self, payload)
         Measurment.__init__(self, probe_id, payload)
-        self.avg_rtt = self.payload[0]
+        self.avg_rtt = self.column_value(self.payload)
 
     @staticmethod
-    def add_args(subparser):
-        """add SSL arguments"""
-        parser = subparser.add_parser('ping', help='SSL check')
+    def column_value(payload):
+        """Return the rtt of a ping payload"""
+        return payload[0]
+
+    @staticmethod
+    def add_args(parser):
+        """add Ping arguments"""
         Measurment.add_args(parser)
-        parser.add_argument('--rtt_max',
+        parser.add_argument('--rtt_max', type=float,
                 help='Ensure the max ttl is below this')
-        parser.add_argument('--rtt_min',
+        parser.add_argument('--rtt_min', type=float,
                 help='Ensure the min ttl is below this')
-        parser.add_argument('--rtt_avg',
+        parser.add_argument('--rtt_avg', type=float,
                 help='Ensure the avg ttl is below this')
+        parser.add_argument('--rtt_p95', type=float,
+                help='ERROR if the 95th percentile rtt of all results '
+                'is above this')
+        parser.add_argument('--columnar', action='store_true',
+                help='Evaluate all probes at once with numpy')
 
     def check_rtt(self, check_type, rtt, message):
         """Check the return trip time islower then rtt"""
-        msg = "desierd (%s), real (%s)" % (rtt, self.avg_rtt)
-        if self.avg_rtt < rtt:
-            message.add_ok(self.probe_id, self.msg % (
-                     msg, "Ping %s" % check_type))
+        msg = "desierd (%s), real (%s) (Ping %s)"
+        if self.avg_rtt is not None and self.avg_rtt < rtt:
+            message.add_ok(self.probe_id, msg,
+                    rtt, self.avg_rtt, check_type)
         else:
-            message.add_error(self.probe_id, self.msg % (
-                    msg, "Ping %s" % check_type))
+            message.add_error(self.probe_id, msg,
+                    rtt, self.avg_rtt, check_type)
 
-    def check(self, args, message):
-        """Main ping check routine"""
-        Measurment.check(self, args, message)
+    def perfdata(self, message):
+        """Add the performance data of the result to message"""
+        Measurment.perfdata(self, message)
+        if self.avg_rtt is not None:
+            message.add_perf('rtt', self.avg_rtt, 'ms')
+
+    @staticmethod
+    def perf_limits(args):
+        """Return the (label, statistic, limit) performance data limits"""
+        if args.rtt_p95 is None:
+            return ()
+        return (('rtt', 'p95', args.rtt_p95),)
+
+    @staticmethod
+    def perf_columns(columns, message):
+        """Add the performance data of ProbeColumns to message"""
+        Measurment.perf_columns(columns, message)
+        message.add_perf_array('rtt',
+                columns.value[~numpy.isnan(columns.value)], 'ms')
+
+    @classmethod
+    def compile_checks(cls, args):
+        """Return the ping checks selected by args"""
+        checks = Measurment.compile_checks(args)
+        for check_type, rtt in (("min", args.rtt_min),
+                ("max", args.rtt_max), ("avg", args.rtt_avg)):
+            if rtt:
+                checks.append(bind_check(cls.check_rtt, check_type, rtt))
+        return checks
 
-        if args.rtt_min:
-            self.check_rtt("min", args.rtt_min, message) 
-        if args.rtt_max:
-            self.check_rtt("max", args.rtt_max, message) 
-        if args.rtt_avg:
-            self.check_rtt("avg", args.rtt_avg, message) 
+    @classmethod
+    def check_columns(cls, columns, args):
+        """Main ping check routine for the columnar engine"""
+        outcomes = Measurment.check_columns(columns, args)
+        for check_type, rtt in (("min", args.rtt_min),
+                ("max", args.rtt_max), ("avg", args.rtt_avg)):
+            if rtt:
+                outcomes.append((columns.value < rtt,
+                        lambda index, rtt=rtt, check_type=check_type: (
+                            "desierd (%s), real (%s) (Ping %s)", rtt,
+                            columns.values[index], check_type)))
+        return outcomes
 
 
 class MeasurmentHTTP(Measurment):
@@ -356,58 +2679,182 @@ class MeasurmentHTTP(Measurment):
         """Initiate object"""
         #super(Measurment, self).__init__(self, payload)
         Measurment.__init__(self, probe_id, payload)
+        self.status = self.column_value(self.payload)
+
+    @staticmethod
+    def column_value(payload):
+        """Return the status of an http payload"""
         try:
-            self.status = self.payload[2][0]['res']
+            return payload[2][0]['res']
         except KeyError:
             try:
-                self.status = self.payload[2][0]['dnserr']
+                return payload[2][0]['dnserr']
             except KeyError:
                 #probably a time out, should use a better status code
-                self.status = 500
+                return 500
 
     @staticmethod
-    def add_args(subparser):
-        """add SSL arguments"""
-        parser = subparser.add_parser('http', help='SSL check')
+    def add_args(parser):
+        """add HTTP arguments"""
         Measurment.add_args(parser)
         parser.add_argument('--status_code', type=int, default=200,
                 help='Ensure the site returns this status code')
+        parser.add_argument('--columnar', action='store_true',
+                help='Evaluate all probes at once with numpy')
 
     def check_status(self, check_status, message):
         """check the HTTP status is the same as check_status"""
-        msg = "desierd (%s), real (%s)" % \
-                (check_status, self.status)
+        msg = "desierd (%s), real (%s) (HTTP Status Code)"
         try:
             if int(self.status) == int(check_status):
-                message.add_ok(self.probe_id, self.msg % (
-                    msg, "HTTP Status Code"))
+                message.add_ok(self.probe_id, msg, check_status, self.status)
             else:
-                message.add_error(self.probe_id, self.msg % (
-                    msg, "HTTP Status Code"))
+                message.add_error(self.probe_id, msg,
+                        check_status, self.status)
         except ValueError:
-            message.add_error(self.probe_id, self.msg % (
-                    msg, "HTTP Status Code"))
+            message.add_error(self.probe_id, msg, check_status, self.status)
 
-    def check(self, args, message):
-        """Main HTTP check routine"""
-        Measurment.check(self, args, message)
+    @staticmethod
+    def status_label(status):
+        """Return the performance data counter of an http status"""
+        try:
+            return 'http_%dxx' % (int(status) // 100)
+        except (TypeError, ValueError):
+            return 'http_error'
+
+    def perfdata(self, message):
+        """Add the performance data of the result to message"""
+        Measurment.perfdata(self, message)
+        message.count_perf(self.status_label(self.status))
+
+    @staticmethod
+    def perf_columns(columns, message):
+        """Add the performance data of ProbeColumns to message"""
+        Measurment.perf_columns(columns, message)
+        #statuses which aren't numbers are dns errors
+        error = numpy.isnan(columns.value)
+        if error.any():
+            message.count_perf('http_error', int(numpy.count_nonzero(error)))
+        classes, counts = numpy.unique(
+                (columns.value[~error] // 100).astype(int),
+                return_counts=True)
+        for status_class, count in zip(classes.tolist(), counts.tolist()):
+            message.count_perf('http_%dxx' % status_class, count)
+
+    @classmethod
+    def compile_checks(cls, args):
+        """Return the HTTP checks selected by args"""
+        checks = Measurment.compile_checks(args)
         if args.status_code:
-            self.check_status(args.status_code, message)
+            checks.append(bind_check(cls.check_status, args.status_code))
+        return checks
+
+    @classmethod
+    def check_columns(cls, columns, args):
+        """Main HTTP check routine for the columnar engine"""
+        outcomes = Measurment.check_columns(columns, args)
+        if args.status_code:
+            outcomes.append((columns.value == args.status_code,
+                    lambda index: (
+                        "desierd (%s), real (%s) (HTTP Status Code)",
+                        args.status_code, columns.values[index])))
+        return outcomes
+
+
+class ResourceRecord(object):
+    """
+    A dns resource record in presentation format, tokenized once
+    identical answers from different probes share the same record
+    """
+    __slots__ = ('owner', 'ttl', 'rrclass', 'rrtype', 'rdata', 'split')
+
+    def __init__(self, answer):
+        """
+        Tokenize answer, rrtype is None if it isn't a resource record
+        quoted strings are a token of their own, spaces included
+        """
+        if '"' in answer:
+            tokens = QUOTED_TOKEN.findall(answer)
+        else:
+            tokens = answer.split()
+        tokens = [intern_token(token) for token in tokens]
+        if len(tokens) < 4:
+            self.owner = self.ttl = self.rrclass = self.rrtype = None
+            self.rdata = tuple(tokens)
+        else:
+            self.owner, self.ttl, self.rrclass, self.rrtype = tokens[:4]
+            self.rdata = tuple(tokens[4:])
+        self.split = {}
+
+    def rdata_fields(self, count):
+        """
+        Return the rdata as count fields
+        the last field holds the remaining tokens, keys and signatures
+        contain spaces, missing fields are None
+        """
+        try:
+            return self.split[count]
+        except KeyError:
+            pass
+        fields = list(self.rdata[:count - 1])
+        fields.append(intern_token(' '.join(self.rdata[count - 1:])) \
+                if len(self.rdata) >= count else None)
+        fields.extend([None] * (count - len(fields)))
+        self.split[count] = fields = tuple(fields)
+        return fields
+
+
+def intern_token(token):
+    """Return the shared copy of token"""
+    return TOKENS.setdefault(token, token)
+
+
+def parse_record(answer):
+    """
+    Return the ResourceRecord for the answer string
+    an answer which isn't a string raises CheckError
+    """
+    if not isinstance(answer, basestring):
+        raise CheckError("Unknown: Unparsable dns record %r" % (answer,))
+    try:
+        return RECORDS[answer]
+    except KeyError:
+        pass
+    if len(RECORDS) >= MAX_RECORDS:
+        RECORDS.clear()
+        TOKENS.clear()
+    record = RECORDS[answer] = ResourceRecord(answer)
+    return record
 
 
 class AnswerDns:
     """Parent class to hold dns measuerment payloads"""
+    #rrtypes the answer may hold, anything else but RRSIG is an error
+    rrtypes = ()
+    #names of the rdata fields, read as attributes of the answer
+    rdata_fields = ()
+    #(option, rrtype, check_type, attribute) of the record checks, rrtype
+    #None applies the check to any of rrtypes
+    fields = ()
 
     def __init__(self, probe_id, answer):
         """Initiate object"""
         self.answer = answer
         self.probe_id = probe_id
-        self.msg = "Probe (%s): %s (%s)" 
-        try:
-            if "RRSIG" == self.answer.split()[3]:
-                self.rrtype = "RRSIG"
-        except IndexError:
-            print self.answer
+        self.msg = "%s (%s)" 
+        self.record = parse_record(answer)
+        if self.record.rrtype is None:
+            raise CheckError("Unknown: Unparsable dns record %r" % answer)
+        self.qname = self.record.owner
+        self.ttl = self.record.ttl
+        self.rrtype = self.record.rrtype
+
+    def __getattr__(self, name):
+        """Return the rdata field name"""
+        if name not in self.rdata_fields:
+            raise AttributeError(name)
+        return self.record.rdata_fields(len(self.rdata_fields))[
+                self.rdata_fields.index(name)]
 
     @staticmethod
     def add_args(subparser):
@@ -419,225 +2866,174 @@ class AnswerDns:
             measurment_string, check_string, message):
         """Generic function to compare two strings"""
         if check_string == measurment_string:
-            message.add_ok(self.probe_id, self.msg % (
-                    check_type, measurment_string))
+            message.add_ok(self.probe_id, self.msg,
+                    check_type, measurment_string)
         else:
-            message.add_error(self.probe_id, self.msg % (
-                check_type, measurment_string))
+            message.add_error(self.probe_id, self.msg,
+                    check_type, measurment_string)
+
+    @classmethod
+    def compile_checks(cls, args):
+        """
+        Return the record checks selected by args
+        as (rrtype, check_type, attribute, expected, option) tuples
+        """
+        return tuple((rrtype, check_type, attribute, getattr(args, option),
+                option) for option, rrtype, check_type, attribute
+                in cls.fields if getattr(args, option, None))
+
+    def apply_checks(self, checks, message):
+        """Run checks from compile_checks against the record"""
+        if self.rrtype == "RRSIG":
+            return
+        elif self.rrtype not in self.rrtypes:
+            message.add_error(self.probe_id, self.msg, "RRTYPE", self.rrtype)
+            return
+        for rrtype, check_type, attribute, expected, _ in checks:
+            if rrtype is None or rrtype == self.rrtype:
+                self.check_string(check_type,
+                        getattr(self, attribute), expected, message)
+
+    def outcomes(self, checks):
+        """
+        Return the (name, expected, measured) of each message apply_checks
+        adds, record checks are named after their option
+        """
+        if self.rrtype == "RRSIG":
+            return []
+        elif self.rrtype not in self.rrtypes:
+            return [('rrtype', ",".join(self.rrtypes), self.rrtype)]
+        return [(option, expected, getattr(self, attribute))
+                for rrtype, _, attribute, expected, option in checks
+                if rrtype is None or rrtype == self.rrtype]
 
     def check(self, args, message):
         """Main Check routine"""
-        raise NotImplementedError("Subclasses should implement this!")
+        self.apply_checks(self.compile_checks(args), message)
 
 
 class AnswerDnsSOA(AnswerDns):
     """Parent class to hold dns SOA measuerment payloads"""
-    def __init__(self, probe_id, answer ):
-        AnswerDns.__init__(self, probe_id, answer)
-        try:
-            if "SOA" == self.answer.split()[3]:
-                self.qname, self.ttl, _,  self.rrtype, self.mname, \
-                        self.rname, self.serial, self.refresh, self.update, \
-                        self.expire, self.nxdomain = answer.split()
-        except IndexError:
-            print self.answer
-
-    def check(self, args, message):
-        """Main Check routine"""
-        if self.rrtype == "RRSIG":
-            return
-        elif self.rrtype != "SOA":
-            message.add_error(self.probe_id, self.msg % (
-                    "RRTYPE", self.rrtype))
-            return
-        else:
-            if args.mname:
-                self.check_string("mname", 
-                        self.mname, args.mname, message) 
-            if args.rname:
-                self.check_string("rname", 
-                        self.rname, args.rname, message) 
-            if args.serial:
-                self.check_string("serial", 
-                        self.serial, args.serial, message) 
-            if args.refresh:
-                self.check_string("refresh", 
-                        self.refresh, args.refresh, message) 
-            if args.update:
-                self.check_string("update", 
-                        self.update, args.update, message) 
-            if args.expire:
-                self.check_string("expire", 
-                        self.expire, args.expire, message) 
-            if args.nxdomain:
-                self.check_string("nxdomain", 
-                        self.nxdomain, args.nxdomain, message) 
+    rrtypes = ("SOA",)
+    rdata_fields = ('mname', 'rname', 'serial', 'refresh', 'update',
+            'expire', 'nxdomain')
+    fields = tuple((field, None, field, field) for field in rdata_fields)
 
 
 class AnswerDnsA(AnswerDns):
     """Parent class to hold dns A measuerment payloads"""
-    def __init__(self, probe_id, answer ):
-        AnswerDns.__init__(self, probe_id, answer)
-        try:
-            if "A" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, \
-                        self.rdata = answer.split()
-            elif "CNAME" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, \
-                        self.rdata = answer.split()
-        except IndexError:
-            print self.answer
-
-    def check(self, args, message):
-        """Main Check routine"""
-        if self.rrtype == "RRSIG":
-            return
-        elif self.rrtype != "A" and self.rrtype != "CNAME":
-            message.add_error(self.probe_id, self.msg % (
-                    "RRTYPE", self.rrtype))
-            return
-        else:
-            if args.cname_record and self.rrtype == "CNAME":
-                self.check_string("cname", 
-                        self.rdata, args.cname_record, message) 
-            if args.a_record and self.rrtype == "A":
-                self.check_string("a", 
-                        self.rdata, args.a_record, message) 
+    rrtypes = ("A", "CNAME")
+    rdata_fields = ('rdata',)
+    fields = (
+            ('cname_record', "CNAME", "cname", 'rdata'),
+            ('a_record', "A", "a", 'rdata'),
+            )
 
 
 class AnswerDnsAAAA(AnswerDns):
     """Parent class to hold dns A measuerment payloads"""
-    def __init__(self, probe_id, answer ):
-        AnswerDns.__init__(self, probe_id, answer)
-        try:
-            if "AAAA" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, \
-                        self.rdata = answer.split()
-            elif "CNAME" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, \
-                        self.rdata = answer.split()
-        except IndexError:
-            print self.answer
-
-    def check(self, args, message):
-        """Main Check routine"""
-        if self.rrtype == "RRSIG":
-            return
-        elif self.rrtype != "AAAA" and self.rrtype != "CNAME":
-            message.add_error(self.probe_id, self.msg % (
-                    "RRTYPE", self.rrtype))
-            return
-        else:
-            if args.cname_record and self.rrtype == "CNAME":
-                self.check_string("cname", 
-                        self.rdata, args.cname_record, message) 
-            if args.aaaa_record and self.rrtype == "AAAA":
-                self.check_string("aaaa", 
-                        self.rdata, args.aaaa_record, message) 
+    rrtypes = ("AAAA", "CNAME")
+    rdata_fields = ('rdata',)
+    fields = (
+            ('cname_record', "CNAME", "cname", 'rdata'),
+            ('aaaa_record', "AAAA", "aaaa", 'rdata'),
+            )
 
 
 class AnswerDnsCNAME(AnswerDns):
     """Parent class to hold dns CNAME measuerment payloads"""
-    def __init__(self, probe_id, answer ):
-        AnswerDns.__init__(self, probe_id, answer)
-        try:
-            if "CNAME" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, \
-                        self.rdata = answer.split()
-        except IndexError:
-            print self.answer
+    rrtypes = ("CNAME",)
+    rdata_fields = ('rdata',)
+    fields = (('cname_record', None, "cname", 'rdata'),)
 
-    def check(self, args, message):
-        """Main Check routine"""
-        if self.rrtype == "RRSIG":
-            return
-        elif self.rrtype != "CNAME":
-            message.add_error(self.probe_id, self.msg % (
-                    "RRTYPE", self.rrtype))
-            return
-        else:
-            if args.cname_record:
-                self.check_string("cname", 
-                        self.rdata, args.cname_record, message) 
- 
 
 class AnswerDnsDNSKEY(AnswerDns):
     """Parent class to hold dns DNSKEY measuerment payloads"""
-    def __init__(self, probe_id, answer ):
-        AnswerDns.__init__(self, probe_id, answer)
-        try:
-            if "DNSKEY" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, \
-                        self.rdata = answer.split()
-        except IndexError:
-            print self.answer
+    rrtypes = ("DNSKEY",)
+    rdata_fields = ('flags', 'protocol', 'algorithm', 'key')
 
-    def check(self, args, message):
-        """Main Check routine"""
-        if self.rrtype == "RRSIG":
-            return
-        elif self.rrtype != "DNSKEY":
-            message.add_error(self.probe_id, self.msg % (
-                    "RRTYPE", self.rrtype))
-            return
-        else:
-            if args.cname_record:
-                self.check_string("cname", 
-                        self.rdata, args.cname_record, message) 
- 
 
 class AnswerDnsDS(AnswerDns):
     """Parent class to hold dns DS measuerment payloads"""
-    def __init__(self, probe_id, answer ):
-        AnswerDns.__init__(self, probe_id, answer)
+    rrtypes = ("DS",)
+    rdata_fields = ('keytag', 'algorithm', 'digest_type', 'digest')
+    fields = (
+            ('keytag', None, "keytag", 'keytag'),
+            ('algorithm', None, "algorithm", 'algorithm'),
+            ('digest_type', None, "digest", 'digest_type'),
+            ('digest', None, "digest", 'digest'),
+            )
+
+
+class MeasurmentDns(Measurment):
+    """Parent class for a dns measuerment"""
+    #AnswerDns subclass holding each record of the answer
+    answer_class = None
+    #(option, rrtype) the answer must contain a record of rrtype if option
+    #is set
+    required_records = ()
+
+    def __init__(self, probe_id, payload):
+        """Initiate Object"""
+        #super(Measurment, self).__init__(self, payload)
+        Measurment.__init__(self, probe_id, payload)
+
+    @staticmethod
+    def payload_key(payload):
+        """
+        Return the fields of the answer the checks read, the records as
+        they are, see Measurment.payload_key
+        """
         try:
-            if "DS" == self.answer.split()[3]:
-                self.qname, self.ttl, _, self.rrtype, self.keytag, \
-                        self.algorithm, self.digest_type, \
-                        self.digest = answer.split()
-        except IndexError:
-            print self.answer
+            result = payload[2]
+            answer = result.get('answer')
+            return (result.get('rcode'), result.get('flags'),
+                    result.get('question'), result.get('additional'),
+                    result.get('authority'),
+                    tuple(answer) if isinstance(answer, list) else answer)
+        except (IndexError, AttributeError):
+            return Measurment.payload_key(payload)
 
-    def check(self, args, message):
-        """Main Check routine"""
-        if self.rrtype == "RRSIG":
-            return
-        elif self.rrtype != "DS":
-            message.add_error(self.probe_id, self.msg % (
-                    "RRTYPE", self.rrtype))
-            return
-        else:
-            if args.keytag:
-                self.check_string("keytag", 
-                        self.keytag, args.keytag, message) 
-            if args.algorithm:
-                self.check_string("algorithm", 
-                        self.algorithm, args.algorithm, message) 
-            if args.digest_type:
-                self.check_string("digest", 
-                        self.digest_type, args.digest_type, message) 
-            if args.digest:
-                self.check_string("digest", 
-                        self.digest, args.digest, message) 
- 
+    @lazy_property
+    def additional(self):
+        """The additional section"""
+        return self.payload[2]['additional']
+
+    @lazy_property
+    def question(self):
+        """The question, split in qname and qtype"""
+        question = { 'qname': "", 'qtype': "", 'question':"" }
+        question['qname'], _, question['qtype'] = \
+                self.payload[2]['question'].split()
+        return question
+
+    @lazy_property
+    def authority(self):
+        """The authority section"""
+        return self.payload[2]['authority']
+
+    @lazy_property
+    def rcode(self):
+        """The rcode of the answer"""
+        return self.payload[2]['rcode']
 
-class MeasurmentDns(Measurment):
-    """Parent class for a dns measuerment"""
+    @lazy_property
+    def flags(self):
+        """The flags of the answer"""
+        return self.payload[2]['flags']
 
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        #super(Measurment, self).__init__(self, payload)
-        Measurment.__init__(self, probe_id, payload)
-        self.additional = self.payload[2]['additional']
-        self.question = { 'qname': "", 'qtype': "", 'question':"" }
-        self.question['qname'], _, self.question['qtype'] = \
-                self.payload[2]['question'].split()
-        self.authority = self.payload[2]['authority']
-        self.rcode = self.payload[2]['rcode']
-        self.flags = self.payload[2]['flags']
-        self.answer = []
+    @lazy_property
+    def answer_raw(self):
+        """The answer records as strings"""
         if self.rcode == "NOERROR":
-            self.answer_raw = ensure_list(self.payload[2]['answer'])
+            return ensure_list(self.payload[2]['answer'])
+        return []
+
+    @lazy_property
+    def answer(self):
+        """The answer records parsed with answer_class"""
+        return [self.answer_class(self.probe_id, ans)
+                for ans in self.answer_raw]
 
     @staticmethod
     def add_args(parser):
@@ -651,47 +3047,80 @@ class MeasurmentDns(Measurment):
 
     def check_rcode(self, rcode, message):
         """Check the RCODE is the same as rcode"""
-        msg = "desierd (%s), real (%s)" % ( rcode, self.rcode)
+        msg = "desierd (%s), real (%s) (DNS RCODE)"
         if self.rcode == rcode:
-            message.add_ok(self.probe_id, self.msg % (
-                    msg, "DNS RCODE"))
+            message.add_ok(self.probe_id, msg, rcode, self.rcode)
         else:
-            message.add_error(self.probe_id, self.msg % (
-                    msg, "DNS RCODE"))
+            message.add_error(self.probe_id, msg, rcode, self.rcode)
 
     def check_flags(self, flags, message):
-        """Check the flags returned in the check are the same as flags"""
-        for flag in flags.split(","):
-            if flag in self.flags.split(): 
-                message.add_ok(self.probe_id, self.msg % (
-                        "Flag found", flag))
+        """Check the flags returned in the check contain all of flags"""
+        found = self.flags.split()
+        for flag in flags:
+            if flag in found:
+                message.add_ok(self.probe_id, self.msg, "Flag found", flag)
             else:
-                message.add_error(self.probe_id, self.msg % (
-                        "Flag Missing ", flag))
+                message.add_error(self.probe_id, self.msg,
+                        "Flag Missing ", flag)
 
-    def check(self, args, message):
-        """Main Check routine"""
-        Measurment.check(self, args, message)
+    def check_flags_outcomes(self, flags, messages):
+        """Return the (name, expected, measured) of check_flags messages"""
+        return [('flags', flag, self.flags) for flag in flags]
+
+    def check_answers(self, answer_checks, required, message):
+        """
+        Run answer_checks against every record of the answer
+        and error for each rrtype in required without a record
+        """
+        found = set()
+        for ans in self.answer:
+            ans.apply_checks(answer_checks, message)
+            found.add(ans.rrtype)
+        for rrtype in required:
+            if rrtype not in found:
+                message.add_error(self.probe_id, self.msg,
+                    "No %s Records Found" % rrtype, "")
+
+    def check_answers_outcomes(self, answer_checks, required, messages):
+        """
+        Return the (name, expected, measured) of check_answers messages
+        those of each record check, then of each missing rrtype
+        """
+        outcomes = []
+        found = set()
+        for ans in self.answer:
+            outcomes.extend(ans.outcomes(answer_checks))
+            found.add(ans.rrtype)
+        outcomes.extend(('rrset', rrtype, None) for rrtype in required
+                if rrtype not in found)
+        return outcomes
 
+    @classmethod
+    def compile_checks(cls, args):
+        """Return the dns checks selected by args"""
+        checks = Measurment.compile_checks(args)
         if args.rcode:
-            self.check_rcode(args.rcode, message)
+            checks.append(bind_check(cls.check_rcode, args.rcode))
         if args.flags:
-            self.check_flags(args.flags, message)
+            checks.append(bind_check(cls.check_flags,
+                    tuple(args.flags.split(","))))
+        if cls.answer_class is not None:
+            required = tuple(rrtype
+                    for option, rrtype in cls.required_records
+                    if getattr(args, option))
+            checks.append(bind_check(cls.check_answers,
+                    cls.answer_class.compile_checks(args), required))
+        return checks
 
 
 class MeasurmentDnsA(MeasurmentDns):
     """class for a dns A measuerment"""
-
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        #super(Measurment, self).__init__(self, payload)
-        MeasurmentDns.__init__(self, probe_id, payload)
-        for ans in self.answer_raw:
-            self.answer.append(AnswerDnsA(self.probe_id, ans))
+    answer_class = AnswerDnsA
+    required_records = (('a_record', "A"), ('cname_record', "CNAME"))
 
     @staticmethod
-    def add_args(subparser):
-        parser = subparser.add_parser('A', help='A DNS check')
+    def add_args(parser):
+        """add A arguments"""
         MeasurmentDns.add_args(parser)
         parser.add_argument('--cname-record',
                 help='Ensure the RR set from the answer \
@@ -700,37 +3129,15 @@ class MeasurmentDnsA(MeasurmentDns):
                 help='Ensure the RR set from the answer \
                         contains a A record with this string')
 
-    def check(self, args, message):
-        a_record = False
-        cname_record = False
-        MeasurmentDns.check(self, args, message)
-        for ans in self.answer:
-            ans.check(args, message)
-            if args.a_record and ans.rrtype == "A":
-                a_record = True
-            if args.cname_record and ans.rrtype == "CNAME":
-                cname_record = True
-        if args.a_record and not a_record:
-            message.add_error(self.probe_id, self.msg % (
-                "No A Records Found", ""))
-        if args.cname_record and not cname_record:
-            message.add_error(self.probe_id, self.msg % (
-                "No CNAME Records Found", ""))
-
 
 class MeasurmentDnsAAAA(MeasurmentDns):
     """class for a dns AAAA measuerment"""
-
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        #super(Measurment, self).__init__(self, payload)
-        MeasurmentDns.__init__(self, probe_id, payload)
-        for ans in self.answer_raw:
-            self.answer.append(AnswerDnsAAAA(self.probe_id, ans))
+    answer_class = AnswerDnsAAAA
+    required_records = (('aaaa_record', "AAAA"), ('cname_record', "CNAME"))
 
     @staticmethod
-    def add_args(subparser):
-        parser = subparser.add_parser('AAAA', help='AAAA DNS check')
+    def add_args(parser):
+        """add AAAA arguments"""
         MeasurmentDns.add_args(parser)
         parser.add_argument('--cname-record',
                 help='Ensure the RR set from the answer \
@@ -740,67 +3147,27 @@ class MeasurmentDnsAAAA(MeasurmentDns):
                         contains a A record with this string')
 
 
-    def check(self, args, message):
-        aaaa_record = False
-        cname_record = False
-        MeasurmentDns.check(self, args, message)
-        for ans in self.answer:
-            ans.check(args, message)
-            if args.aaaa_record and ans.rrtype == "AAAA":
-                aaaa_record = True
-            if args.cname_record and ans.rrtype == "CNAME":
-                cname_record = True
-        if args.aaaa_record and not aaaa_record:
-            message.add_error(self.probe_id, self.msg % (
-                "No AAAA Records Found", ""))
-        if args.cname_record and not cname_record:
-            message.add_error(self.probe_id, self.msg % (
-                "No CNAME Records Found", ""))
-
-
 class MeasurmentDnsCNAME(MeasurmentDns):
     """class for a dns CNAME measuerment"""
-
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        #super(Measurment, self).__init__(self, payload)
-        MeasurmentDns.__init__(self, probe_id, payload)
-        for ans in self.answer_raw:
-            self.answer.append(AnswerDnsCNAME(self.probe_id, ans))
+    answer_class = AnswerDnsCNAME
+    required_records = (('cname_record', "CNAME"),)
 
     @staticmethod
-    def add_args(subparser):
-        parser = subparser.add_parser('CNAME', help='CNAME DNS check')
+    def add_args(parser):
+        """add CNAME arguments"""
         MeasurmentDns.add_args(parser)
         parser.add_argument('--cname-record',
                 help='Ensure the RR set from the answer \
                         contains a CNAME record with this string')
 
-    def check(self, args, message):
-        cname_record = False
-        MeasurmentDns.check(self, args, message)
-        for ans in self.answer:
-            ans.check(args, message)
-            if args.cname_record and ans.rrtype == "CNAME":
-                cname_record = True
-        if args.cname_record and not cname_record:
-            message.add_error(self.probe_id, self.msg % (
-                "No CNAME Records Found", ""))
-
 
 class MeasurmentDnsDS(MeasurmentDns):
     """class for a dns DS measuerment"""
-
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        #super(Measurment, self).__init__(self, payload)
-        MeasurmentDns.__init__(self, probe_id, payload)
-        for ans in self.answer_raw:
-            self.answer.append(AnswerDnsDS(self.probe_id, ans))
+    answer_class = AnswerDnsDS
 
     @staticmethod
-    def add_args(subparser):
-        parser = subparser.add_parser('DS', help='CNAME DS check')
+    def add_args(parser):
+        """add DS arguments"""
         MeasurmentDns.add_args(parser)
         parser.add_argument('--keytag',
                 help='Ensure the RR set from the answer \
@@ -815,44 +3182,24 @@ class MeasurmentDnsDS(MeasurmentDns):
                 help='Ensure the RR set from the answer \
                         contains a digest record with this string')
 
-    def check(self, args, message):
-        MeasurmentDns.check(self, args, message)
-        for ans in self.answer:
-            ans.check(args, message)
 
-      
 class MeasurmentDnsDNSKEY(MeasurmentDns):
     """class for a dns DNSKEY measurement"""
-
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        MeasurmentDns.__init__(self, probe_id, payload)
-        for ans in self.answer_raw:
-            self.answer.append(AnswerDnsDNSKEY(self.probe_id, ans))
+    answer_class = AnswerDnsDNSKEY
 
     @staticmethod
-    def add_args(subparser):
-        parser = subparser.add_parser('DNSKEY', help='CNAME DNSKEY check')
+    def add_args(parser):
+        """add DNSKEY arguments"""
         MeasurmentDns.add_args(parser)
 
-    def check(self, args, message):
-        MeasurmentDns.check(self, args, message)
-        for ans in self.answer:
-            ans.check(args, message)
 
 class MeasurmentDnsSOA(MeasurmentDns):
     """class for a dns SOA measuerment"""
-
-    def __init__(self, probe_id, payload):
-        """Initiate Object"""
-        #super(Measurment, self).__init__(self, payload)
-        MeasurmentDns.__init__(self, probe_id, payload)
-        for ans in self.answer_raw:
-            self.answer.append(AnswerDnsSOA(self.probe_id, ans))
+    answer_class = AnswerDnsSOA
 
     @staticmethod
-    def add_args(subparser):
-        parser = subparser.add_parser('SOA', help='CNAME SOA check')
+    def add_args(parser):
+        """add SOA arguments"""
         MeasurmentDns.add_args(parser)
         parser.add_argument('--mname',
                 help='Ensure the soa has this mname')
@@ -869,43 +3216,1140 @@ class MeasurmentDnsSOA(MeasurmentDns):
         parser.add_argument('--nxdomain',
                 help='Ensure the soa has this nxdomain')
 
-    def check(self, args, message):
-        MeasurmentDns.check(self, args, message)
-        for ans in self.answer:
-            ans.check(args, message)
-
-def arg_parse():
-    """Parse arguments"""
-    parser = argparse.ArgumentParser(description=__doc__)
-    subparsers = parser.add_subparsers( 
-            title="Supported Measuerment types", dest='name')
-
-    #measuerement types
-    MeasurmentSSL.add_args(subparsers)
-    MeasurmentPing.add_args(subparsers)
-    MeasurmentHTTP.add_args(subparsers)
-    dns_parser = subparsers.add_parser('dns', help='DNS check')
-    dns_subparsers = dns_parser.add_subparsers( 
-            title="Supported DNS Measuerment types", dest='name')
-    MeasurmentDnsA.add_args(dns_subparsers)
-    MeasurmentDnsAAAA.add_args(dns_subparsers)
-    MeasurmentDnsCNAME.add_args(dns_subparsers)
-    MeasurmentDnsDS.add_args(dns_subparsers)
-    MeasurmentDnsDNSKEY.add_args(dns_subparsers)
-    MeasurmentDnsSOA.add_args(dns_subparsers)
-
-    return parser.parse_args()
+
+def intern_path(hops):
+    """Return the shared (hops, hash) of the traceroute path hops"""
+    try:
+        return PATHS[hops]
+    except KeyError:
+        pass
+    if len(PATHS) >= MAX_RECORDS:
+        PATHS.clear()
+    path = PATHS[hops] = (hops, hashlib.sha1(' '.join(hops)).hexdigest()[:16])
+    return path
+
+
+class PathBaseline:
+    """
+    Path hash of each probe of a traceroute measurement kept in a json
+    file, the path of a probe seen for the first time is learned
+    """
+
+    def __init__(self, filename):
+        """Load the baseline in filename, missing it knows no probe"""
+        self.filename = filename
+        self.paths = {}
+        self.changed = False
+        try:
+            with open(filename) as baseline:
+                self.paths = json.load(baseline)
+        except (IOError, ValueError):
+            pass
+
+    def compare(self, probe_id, path_hash, update=False):
+        """
+        Return the baseline path hash of probe_id
+        path_hash becomes the baseline of a new probe, or with update
+        """
+        probe = str(probe_id)
+        baseline = self.paths.get(probe)
+        if baseline is None or (update and baseline != path_hash):
+            self.paths[probe] = path_hash
+            self.changed = True
+            return path_hash
+        return baseline
+
+    def save(self):
+        """Replace the baseline file if paths were learned"""
+        if not self.changed:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(handle, 'w') as baseline:
+                json.dump(self.paths, baseline)
+            os.rename(temp, self.filename)
+        except (IOError, OSError):
+            pass
+        self.changed = False
+
+
+def get_baseline(filename):
+    """
+    Return the PathBaseline of filename, loaded once per check run
+    each thread has baselines of its own, so concurrent checks don't
+    save or drop the baselines of another
+    """
+    baselines = getattr(BASELINES, 'baselines', None)
+    if baselines is None:
+        baselines = BASELINES.baselines = {}
+    try:
+        return baselines[filename]
+    except KeyError:
+        baseline = baselines[filename] = PathBaseline(filename)
+        return baseline
+
+
+def save_baselines():
+    """Save the baselines the check of this thread learned paths in"""
+    baselines = getattr(BASELINES, 'baselines', None)
+    if not baselines:
+        return
+    for baseline in baselines.itervalues():
+        baseline.save()
+    baselines.clear()
+
+
+class MeasurmentTraceroute(Measurment):
+    """Object for an atlas traceroute Measurment"""
+    volatile_checks = Measurment.volatile_checks + ('check_path',)
+
+    def __init__(self, probe_id, payload):
+        """Initiate object"""
+        Measurment.__init__(self, probe_id, payload)
+        #set by check_path
+        self.path_changed = None
+
+    @lazy_property
+    def path(self):
+        """
+        The (hops, hash) of the path, a hop is the addresses which
+        answered for it joined by |, * if none did
+        """
+        hops = []
+        for hop in ensure_list(self.payload[2]):
+            addresses = sorted(set(reply['from']
+                    for reply in hop.get('result', ()) if 'from' in reply))
+            hops.append(intern_token('|'.join(addresses)) \
+                    if addresses else '*')
+        return intern_path(tuple(hops))
+
+    @lazy_property
+    def addresses(self):
+        """The addresses of all the hops"""
+        return frozenset(address for hop in self.path[0]
+                for address in hop.split('|'))
+
+    @staticmethod
+    def add_args(parser):
+        """add traceroute arguments"""
+        Measurment.add_args(parser)
+        parser.add_argument('--hops',
+                help='Coma seperated list of addresses the path must go '
+                'through')
+        parser.add_argument('--forbidden-hops',
+                help="Coma seperated list of addresses the path mustn't go "
+                'through')
+        parser.add_argument('--max-hops', type=int,
+                help='Ensure the path has at most this many hops')
+        parser.add_argument('--path-baseline',
+                help='Warn about paths which differ from the path of the '
+                'probe kept in this directory, new probes are learned')
+        parser.add_argument('--update-baseline', action='store_true',
+                help='Make the current paths the baseline')
+        parser.add_argument('--path-changes', type=float,
+                help='ERROR if more than this fraction of the probes '
+                'changed path')
+
+    def check_hops(self, hops, message):
+        """Check the path goes through all hops"""
+        for hop in hops:
+            if hop in self.addresses:
+                message.add_ok(self.probe_id, self.msg, "hop found", hop)
+            else:
+                message.add_error(self.probe_id, self.msg,
+                        "hop missing", hop)
+
+    def check_hops_outcomes(self, hops, messages):
+        """Return the (name, expected, measured) of check_hops messages"""
+        return [('hops', hop, hop if hop in self.addresses else None)
+                for hop in hops]
+
+    def check_forbidden_hops(self, hops, message):
+        """Check the path goes through none of hops"""
+        for hop in hops:
+            if hop in self.addresses:
+                message.add_error(self.probe_id, self.msg,
+                        "forbidden hop", hop)
+            else:
+                message.add_ok(self.probe_id, self.msg,
+                        "forbidden hop avoided", hop)
+
+    def check_forbidden_hops_outcomes(self, hops, messages):
+        """
+        Return the (name, expected, measured) of check_forbidden_hops
+        messages, the expected value is the hop to avoid
+        """
+        return [('forbidden_hops', hop,
+                hop if hop in self.addresses else None) for hop in hops]
+
+    def check_hop_count(self, max_hops, message):
+        """Check the path is at most max_hops long"""
+        msg = "desierd (%s), real (%s) (Traceroute hops)"
+        if len(self.path[0]) <= max_hops:
+            message.add_ok(self.probe_id, msg, max_hops, len(self.path[0]))
+        else:
+            message.add_error(self.probe_id, msg,
+                    max_hops, len(self.path[0]))
+
+    def check_path(self, update, filename, message):
+        """
+        Check the path hash is the one in the baseline in filename
+        with update the baseline takes the current path
+        """
+        msg = "desierd (%s), real (%s) (Traceroute path)"
+        baseline = get_baseline(filename).compare(self.probe_id,
+                self.path[1], update)
+        self.path_changed = baseline != self.path[1]
+        if self.path_changed:
+            message.add_warn(self.probe_id, msg, baseline, self.path[1])
+        else:
+            message.add_ok(self.probe_id, msg, baseline, self.path[1])
+
+    def perfdata(self, message):
+        """Add the performance data of the result to message"""
+        Measurment.perfdata(self, message)
+        message.add_perf('hops', len(self.path[0]))
+        if self.path_changed is not None:
+            message.add_perf('path_changed', int(self.path_changed))
+
+    @staticmethod
+    def perf_limits(args):
+        """Return the (label, statistic, limit) performance data limits"""
+        if args.path_changes is None:
+            return ()
+        return (('path_changed', 'mean', args.path_changes),)
+
+    @classmethod
+    def compile_checks(cls, args):
+        """Return the traceroute checks selected by args"""
+        checks = Measurment.compile_checks(args)
+        if args.hops:
+            checks.append(bind_check(cls.check_hops,
+                    tuple(args.hops.split(","))))
+        if args.forbidden_hops:
+            checks.append(bind_check(cls.check_forbidden_hops,
+                    tuple(args.forbidden_hops.split(","))))
+        if args.max_hops:
+            checks.append(bind_check(cls.check_hop_count, args.max_hops))
+        if args.path_baseline:
+            checks.append(bind_check(cls.check_path, args.update_baseline,
+                    os.path.join(args.path_baseline,
+                    '%s.paths' % args.measurement_id)))
+        return checks
+
+
+register_check_type(('ssl',), 'SSL check', MeasurmentSSL)
+register_check_type(('ping',), 'Ping check', MeasurmentPing)
+register_check_type(('http',), 'HTTP check', MeasurmentHTTP)
+register_check_group('dns', 'DNS check',
+        "Supported DNS Measuerment types")
+register_check_type(('dns', 'A'), 'A DNS check', MeasurmentDnsA)
+register_check_type(('dns', 'AAAA'), 'AAAA DNS check', MeasurmentDnsAAAA)
+register_check_type(('dns', 'CNAME'), 'CNAME DNS check', MeasurmentDnsCNAME)
+register_check_type(('dns', 'DS'), 'DS DNS check', MeasurmentDnsDS)
+register_check_type(('dns', 'DNSKEY'), 'DNSKEY DNS check',
+        MeasurmentDnsDNSKEY)
+register_check_type(('dns', 'SOA'), 'SOA DNS check', MeasurmentDnsSOA)
+register_check_type(('traceroute',), 'Traceroute check',
+        MeasurmentTraceroute)
+
+
+class CheckRequestHandler(SocketServer.StreamRequestHandler):
+    """Run one check per connection for the check server
+
+    The client sends the command line as a json list on a single line, the
+    reply is a json object holding the exit code, stdout and stderr of the
+    check exactly as the command line tool would have produced them.
+    """
+
+    def handle(self):
+        """Run the requested check and send back the result"""
+        try:
+            argv = json.loads(self.rfile.readline())
+        except ValueError as error:
+            result = (3, '', 'Unknown: invalid check request: %s\n' % error)
+        else:
+            result = run_captured(argv)
+        self.wfile.write(json.dumps({
+            'code': result[0],
+            'stdout': result[1],
+            'stderr': result[2],
+            }) + '\n')
+
+
+class CheckServer(SocketServer.ThreadingMixIn,
+        SocketServer.UnixStreamServer):
+    """
+    Unix socket server keeping the interpreter and http session warm
+    each request runs in a thread of its own, a slow fetch doesn't hold
+    up the other checks
+    """
+    daemon_threads = True
+
+    def __init__(self, path):
+        """Bind to path, replacing a stale socket left by a previous run"""
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path,
+                CheckRequestHandler)
+
+
+def serve(path):
+    """Answer check requests on the unix socket at path until killed"""
+    server = CheckServer(path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def run_captured(argv):
+    """
+    Run a check with argv as the command line
+    returns (exit code, stdout, stderr), the output is captured per call
+    so concurrent requests don't mix their output
+    """
+    stdout, stderr = StringIO(), StringIO()
+    try:
+        args = arg_parse(argv, stdout, stderr)
+        if args.name in RUN_MODES:
+            stderr.write("Unknown: can't start %s from a server\n" %
+                    args.name)
+            code = 3
+        else:
+            check_shared_options(args, 'server')
+            code, output = check_args(args)
+            stdout.write(output + '\n')
+    except SystemExit as exit_status:
+        code = exit_status.code or 0
+    except CheckError as error:
+        stdout.write("%s\n" % error)
+        code = 3
+    except Exception as error:
+        stdout.write("Unknown: %s\n" % error)
+        code = 3
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+def add_global_args(parser):
+    """Add the arguments shared by every command"""
+    parser.add_argument('--api-url', default=API_URL,
+            help='Base url of the atlas api')
+    parser.add_argument('--connect-timeout', type=float, default=5,
+            help='Seconds to wait for a connection to the api')
+    parser.add_argument('--read-timeout', type=float, default=30,
+            help='Seconds to wait for the api to answer')
+    parser.add_argument('--retries', type=int, default=2,
+            help='Retry failed api requests this many times, a request '
+            'the api asks to retry after more than --read-timeout fails')
+    parser.add_argument('--stream', action='store_true',
+            help='Decode and check probe results while they are downloaded')
+    parser.add_argument('--cache-dir',
+            help='Share api responses between checks through this directory')
+    parser.add_argument('--cache-ttl', type=int, default=60,
+            help='Seconds a cached response is used without revalidation')
+    parser.add_argument('--cache-max-size', type=int, default=64,
+            help='Megabytes of responses to keep in the cache')
+    parser.add_argument('--cache-stale', type=int, default=0,
+            help='Seconds a cached response may be used if the api fails')
+    parser.add_argument('--rate-limit', type=float,
+            help='Make at most this many api requests per second')
+    parser.add_argument('--rate-burst', type=int,
+            help='Allow bursts of this many requests, defaults to the rate')
+    parser.add_argument('--rate-lock',
+            help='Share the rate limit with every process using this file')
+    parser.add_argument('--probe-index',
+            help='Sqlite file with the probe metadata, see index')
+    parser.add_argument('--timings', action='store_true',
+            help='Add the seconds spent in each phase to the perfdata')
+    parser.add_argument('--timings-statsd',
+            help='Send the timings as statsd timers to this host:port')
+    parser.add_argument('--timings-file',
+            help='Append the timings of each check to this file')
+    parser.add_argument('--timings-prefix', default='atlas_nagios',
+            help='Prefix of the statsd timers')
+    parser.add_argument('--processes', type=int, default=1,
+            help='Parse and check the results in this many processes')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE,
+            help='Results each process checks at a time')
+
+
+class CheckParser(argparse.ArgumentParser):
+    """
+    Argument parser writing its usage, help and errors to the streams
+    arg_parse was given in the thread parsing, e.g. of a server request
+    """
+    streams = threading.local()
+
+    def _print_message(self, message, file=None):
+        """Write message to file or to the stream standing in for it"""
+        output = getattr(self.streams, 'output', None)
+        if message and output is not None:
+            output[1 if file is sys.stderr else 0].write(message)
+            return
+        argparse.ArgumentParser._print_message(self, message, file)
+
+
+class SelectorParser(argparse.ArgumentParser):
+    """Parser finding the command of a command line without reporting errors"""
+
+    def error(self, message):
+        """Leave the error to the full parser"""
+        raise ValueError(message)
+
+
+def selected_check_type(argv):
+    """Return the registered check type path argv selects, None if none"""
+    global SELECTOR
+    if SELECTOR is None:
+        SELECTOR = SelectorParser(add_help=False)
+        add_global_args(SELECTOR)
+        SELECTOR.add_argument('command', nargs=argparse.REMAINDER)
+    try:
+        command = SELECTOR.parse_known_args(argv)[0].command
+    except ValueError:
+        return None
+    for length in (1, 2):
+        if tuple(command[:length]) in CHECK_TYPES:
+            return tuple(command[:length])
+    return None
+
+
+def build_parser(argv=None):
+    """
+    Build the argument parser, it is only built once per process
+    a check type only gets its arguments once a command line selects it,
+    the other check types are listed in the help but not built, server
+    requests parsed at the same time wait for each other
+    """
+    with PARSER_LOCK:
+        return build_parser_locked(argv)
+
+
+def build_parser_locked(argv=None):
+    """Build the argument parser holding PARSER_LOCK, see build_parser"""
+    global PARSER
+    if PARSER is None:
+        parser = CheckParser(description=__doc__)
+        add_global_args(parser)
+        subparsers = parser.add_subparsers(
+                title="Supported Measuerment types", dest='name')
+
+        #measuerement types
+        groups = {}
+        for path in CHECK_TYPES:
+            if len(path) == 2 and path[0] not in groups:
+                help, title = CHECK_GROUPS[path[0]]
+                groups[path[0]] = subparsers.add_parser(path[0],
+                        help=help).add_subparsers(title=title, dest='name')
+            commands = groups[path[0]] if len(path) == 2 else subparsers
+            UNBUILT_PARSERS[path] = commands.add_parser(path[-1],
+                    help=CHECK_TYPES[path][0])
+
+        #run modes
+        server_parser = subparsers.add_parser('server',
+                help='Run checks sent over a unix socket')
+        server_parser.add_argument('socket',
+                help='Path of the unix socket to listen on')
+        batch_parser = subparsers.add_parser('batch',
+                help='Run many checks, fetching measurements concurrently')
+        batch_parser.add_argument('definitions',
+                help='File with the arguments of one check per line')
+        batch_parser.add_argument('--workers', type=int, default=16,
+                help='Number of measurements to fetch at the same time')
+        subparsers.add_parser('index',
+                help='Refresh the probe index from the api, e.g. daily')
+        poll_parser = subparsers.add_parser('poll',
+                help='Poll measurements and submit passive check results')
+        poll_parser.add_argument('definitions',
+                help='File with one host;service;check arguments per line')
+        poll_output = poll_parser.add_mutually_exclusive_group(
+                required=True)
+        poll_output.add_argument('--command-file',
+                help='Submit the results to this nagios command file')
+        poll_output.add_argument('--spool-dir',
+                help='Submit the results to this nagios check result '
+                'directory')
+        poll_parser.add_argument('--workers', type=int, default=16,
+                help='Number of measurements to fetch at the same time')
+        poll_parser.add_argument('--min-interval', type=int, default=60,
+                help='Never poll a measurement more often than this, and '
+                'this often if the api has no interval for it')
+        poll_parser.add_argument('--jitter', type=float, default=0.1,
+                help='Delay polls by up to this fraction of the interval')
+        poll_parser.add_argument('--once', action='store_true',
+                help='Poll every measurement once and exit')
+        stream_parser = subparsers.add_parser('stream',
+                help='Follow result streams and submit passive check '
+                'results as they change')
+        stream_parser.add_argument('definitions',
+                help='File with one host;service;check arguments per line')
+        stream_output = stream_parser.add_mutually_exclusive_group(
+                required=True)
+        stream_output.add_argument('--command-file',
+                help='Submit the results to this nagios command file')
+        stream_output.add_argument('--spool-dir',
+                help='Submit the results to this nagios check result '
+                'directory')
+        stream_parser.add_argument('--stream-url', required=True,
+                help='Base url of the server pushing the results of '
+                '/measurement/<id>/stream/ as json lines, the atlas api '
+                "has no such endpoint. /latest/ is polled while it's lost")
+        stream_parser.add_argument('--refresh', type=int, default=300,
+                help='Submit unchanged results again after this many '
+                'seconds')
+        stream_parser.add_argument('--settle', type=float, default=1,
+                help='Check a measurement at most this often while its '
+                'results arrive')
+        stream_parser.add_argument('--retry', type=int, default=30,
+                help='Seconds to wait before following a lost stream again, '
+                'the latest results are fetched meanwhile')
+        stream_parser.add_argument('--duration', type=int,
+                help='Stop after this many seconds')
+
+        PARSER = parser
+    path = selected_check_type(sys.argv[1:] if argv is None else argv)
+    if path in UNBUILT_PARSERS:
+        check_type(path).add_args(UNBUILT_PARSERS.pop(path))
+    return PARSER
+
+
+def arg_parse(argv=None, stdout=None, stderr=None):
+    """
+    Parse arguments
+    with stdout and stderr the usage, help and errors are written to
+    them instead of sys.stdout and sys.stderr
+    """
+    parser = build_parser(argv)
+    if stdout is None:
+        return parser.parse_args(argv)
+    CheckParser.streams.output = (stdout, stderr)
+    try:
+        return parser.parse_args(argv)
+    finally:
+        CheckParser.streams.output = None
+
+
+def check_state(args):
+    """Return the CheckState of args, None without --state-dir"""
+    if args.state_dir:
+        return CheckState(args.state_dir, args)
+    return None
+
+
+def check_planned(args, measurements, message, timings=None):
+    """
+    Parse and check measurements with the CheckPlan of args
+    in the SHARD_POOL unless outcomes are kept or exported
+    """
+    #outcomes kept, exported or compared with a baseline stay here
+    if SHARD_POOL is not None and not (args.state_dir or args.export or
+            getattr(args, 'path_baseline', None)):
+        check_sharded(measurements, args, message)
+        return
+    plan = compile_plan(args)
+    export = outcome_export(args)
+    try:
+        if args.dedupe and not args.state_dir:
+            check_deduplicated(measurements, plan, message, export)
+            return
+        parsed_measurements = parse_measurements(
+                measurements, plan.measurement_type, message)
+        if timings is not None:
+            parsed_measurements = timings.iter_phase('parse',
+                    parsed_measurements)
+        check_measurements(parsed_measurements, plan, message,
+                check_state(args), export)
+    finally:
+        if export is not None:
+            export.close()
+        save_baselines()
+
+
+def check_result(args, measurements, timings=None):
+    """
+    Parse and check measurements for args, return (status, output)
+    with timings the time of each phase is added to it and to the
+    performance data of the output
+    """
+    message = ProbeMessage.from_args(args)
+    if args.skip_disconnected:
+        if get_probe_index() is None:
+            raise CheckError(
+                    "Unknown: --skip-disconnected needs --probe-index")
+        measurements = get_probe_index().connected(measurements)
+    if timings is None:
+        if getattr(args, 'columnar', False):
+            check_columnar(measurements, args, message)
+        else:
+            check_planned(args, measurements, message)
+        return message.result()
+
+    #streamed results are downloaded while they are parsed
+    measurements = timings.iter_phase('fetch', measurements)
+    timings.start('check')
+    try:
+        if getattr(args, 'columnar', False):
+            check_columnar(measurements, args, message)
+        else:
+            check_planned(args, measurements, message, timings)
+    finally:
+        timings.stop()
+    timings.start('output')
+    status, output = message.result()
+    timings.stop()
+    return status, add_perfdata(output, timings.perfdata())
+
+
+def timed_check(args, fetch=None):
+    """
+    Fetch and check the measurement of args timing each phase
+    fetch is the (results, Timings) of an already fetched measurement
+    returns (status, output)
+    """
+    timings = Timings()
+    if fetch is None:
+        set_timings(timings)
+        try:
+            timings.start('fetch')
+            try:
+                measurements = fetch_results(args)
+            finally:
+                timings.stop()
+            status, output = check_result(args, measurements, timings)
+        finally:
+            set_timings(None)
+    else:
+        measurements, fetch_timings = fetch
+        timings.merge(fetch_timings)
+        status, output = check_result(args, measurements, timings)
+    if TIMINGS_SINK is not None:
+        TIMINGS_SINK.send(args.name.lower(), timings, status)
+    return status, output
+
+
+def check_args(args):
+    """
+    Fetch and check the measurement described by args
+    returns (status, output), UNKNOWN for a CheckError
+    """
+    try:
+        if args.timings:
+            return timed_check(args)
+        measurements = fetch_results(args)
+        return check_result(args, measurements)
+    except CheckError as error:
+        return 3, str(error)
+
+
+def run_check(args):
+    """Run the check described by args and exit with the nagios status"""
+    status, output = check_args(args)
+    print output
+    sys.exit(status)
+
+
+def read_definitions(path):
+    """Read the check definitions in path, skipping blanks and comments"""
+    with open(path) as definitions:
+        return [line.strip() for line in definitions
+                if line.strip() and not line.lstrip().startswith('#')]
+
+
+def fetch_key(args):
+    """
+    Return what identifies the results a check fetches
+    the snapshot dir too, the fetch saves the snapshot
+    """
+    return (args.measurement_id, args.window, args.from_file,
+            args.from_snapshot, args.snapshot_dir)
+
+
+def fetch_measurement(args):
+    """
+    Fetch results for a worker
+    returns (key, results or CheckError, Timings of the fetch or None)
+    """
+    key = fetch_key(args)
+    timings = None
+    if args.timings:
+        timings = Timings()
+        set_timings(timings)
+        timings.start('fetch')
+    try:
+        return key, list(fetch_results(args)), timings
+    except CheckError as error:
+        return key, error, timings
+    except Exception as error:
+        return key, CheckError("Unknown: %s" % error), timings
+    finally:
+        if timings is not None:
+            timings.stop()
+            set_timings(None)
+
+
+def parse_definition(definition, timings=False, mode='batch'):
+    """
+    Parse the command line of a check definition run by mode
+    raises a CheckError if it is invalid, starts a run mode or changes a
+    shared option
+    """
+    try:
+        args = arg_parse(shlex.split(definition))
+    except (SystemExit, ValueError):
+        raise CheckError("Unknown: invalid check definition")
+    if args.name in RUN_MODES:
+        raise CheckError("Unknown: can't start %s from a check definition"
+                % args.name)
+    check_shared_options(args, mode)
+    args.timings = args.timings or timings
+    return args
+
+
+def check_fetched(args, measurements, fetch_timings=None):
+    """
+    Check results returned by fetch_measurement
+    returns (status, output), UNKNOWN for any error
+    """
+    if isinstance(measurements, CheckError):
+        return 3, str(measurements)
+    try:
+        if args.timings:
+            return timed_check(args,
+                    (measurements, fetch_timings or Timings()))
+        return check_result(args, measurements)
+    except CheckError as error:
+        return 3, str(error)
+    except Exception as error:
+        return 3, "Unknown: %s" % error
+
+
+def run_batch(definitions, workers, timings=False):
+    """
+    Run a check for each command line in definitions
+    Measurements are fetched concurrently, once per measurement id and
+    window, and checked as they arrive. returns [(definition, status,
+    output)] in the order of definitions. with timings every check is
+    timed as with --timings
+    """
+    results = [None] * len(definitions)
+    checks = {}
+    for index, definition in enumerate(definitions):
+        try:
+            args = parse_definition(definition, timings)
+        except CheckError as error:
+            results[index] = (definition, 3, str(error))
+            continue
+        checks.setdefault(fetch_key(args), []).append((index, args))
+
+    pool = multiprocessing_pool.ThreadPool(max(1, min(workers, len(checks))))
+    try:
+        for key, measurements, fetch_timings in pool.imap_unordered(
+                fetch_measurement,
+                [fetched[0][1] for fetched in checks.itervalues()]):
+            for index, args in checks[key]:
+                status, output = check_fetched(args, measurements,
+                        fetch_timings)
+                results[index] = (definitions[index], status, output)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+class CommandFileWriter:
+    """Submit passive check results through the nagios command file"""
+
+    def __init__(self, path):
+        """Initiate the writer of the command file at path"""
+        self.path = path
+
+    def write(self, results):
+        """Submit (host, service, status, output) results in one write"""
+        now = int(time.time())
+        commands = "".join(
+                "[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" % (now,
+                host, service, status, output.replace("\n", "\\n"))
+                for host, service, status, output in results)
+        with open(self.path, 'a') as command_file:
+            command_file.write(commands)
+
+
+class SpoolWriter:
+    """Submit passive check results as nagios check result files"""
+
+    def __init__(self, path):
+        """Initiate the writer of the check result directory path"""
+        self.path = path
+
+    def write(self, results):
+        """Submit (host, service, status, output) results in one file"""
+        now = time.time()
+        handle, filename = tempfile.mkstemp(prefix='c', dir=self.path)
+        with os.fdopen(handle, 'w') as spool:
+            spool.write("### Active Check Result File ###\n"
+                    "file_time=%d\n\n" % now)
+            for host, service, status, output in results:
+                spool.write("### Nagios Service Check Result ###\n"
+                        "# Time: %s\n"
+                        "host_name=%s\n"
+                        "service_description=%s\n"
+                        "check_type=1\n"
+                        "check_options=0\n"
+                        "scheduled_check=0\n"
+                        "reschedule_check=0\n"
+                        "latency=0\n"
+                        "start_time=%.6f\n"
+                        "finish_time=%.6f\n"
+                        "early_timeout=0\n"
+                        "exited_ok=1\n"
+                        "return_code=%d\n"
+                        "output=%s\n\n" % (time.ctime(now), host, service,
+                        now, now, status, output.replace("\n", "\\n")))
+        open(filename + '.ok', 'w').close()
+
+
+def read_poll_definitions(path):
+    """
+    Read the poll definitions in path
+    returns [(host, service, check command line)], lines are
+    host;service;check command line
+    """
+    definitions = []
+    for line in read_definitions(path):
+        fields = line.split(';', 2)
+        if len(fields) != 3:
+            raise CheckError("Unknown: invalid poll definition: %s" % line)
+        definitions.append(tuple(field.strip() for field in fields))
+    return definitions
+
+
+def measurement_interval(measurement_id, default):
+    """Return the interval of a measurement from the api"""
+    try:
+        interval = get_client().get_json(
+                get_client().url('measurement', measurement_id))['interval']
+        return int(interval) or default
+    except (CheckError, KeyError, TypeError, ValueError):
+        return default
+
+
+def next_poll(measurements, interval, min_interval, jitter):
+    """
+    Return when to poll a measurement next
+    new results aren't expected before the newest one is interval old
+    """
+    now = time.time()
+    due = now + interval
+    if not isinstance(measurements, CheckError):
+        newest = [measurement[5][1] for measurement in measurements
+                if measurement[5] is not None]
+        if newest:
+            due = max(now + min_interval, max(newest) + interval)
+    return due + random.uniform(0, jitter * interval)
+
+
+def run_poll(definitions, writer, workers=16, min_interval=60, jitter=0.1,
+        once=False, timings=False):
+    """
+    Poll the measurements of definitions forever, or once
+    definitions are (host, service, check command line). each
+    measurement is fetched when its probes should have new results and
+    checked for all its definitions, the results of a round of polls are
+    submitted together with writer
+    """
+    checks = {}
+    invalid = []
+    for host, service, definition in definitions:
+        try:
+            args = parse_definition(definition, timings, 'poll')
+        except CheckError as error:
+            invalid.append((host, service, 3, str(error)))
+            continue
+        checks.setdefault(fetch_key(args), []).append((host, service, args))
+    if invalid:
+        writer.write(invalid)
+
+    pool = multiprocessing_pool.ThreadPool(max(1, min(workers, len(checks))))
+    try:
+        keys = list(checks)
+        intervals = dict(zip(keys, pool.map(
+                lambda key: measurement_interval(key[0], min_interval),
+                keys)))
+        now = time.time()
+        schedule = [(now + random.uniform(0, jitter * intervals[key]), key)
+                for key in keys]
+        heapq.heapify(schedule)
+        while schedule:
+            time.sleep(max(0, schedule[0][0] - time.time()))
+            #polls due within a second are submitted together
+            due = []
+            while schedule and schedule[0][0] <= time.time() + 1:
+                due.append(heapq.heappop(schedule)[1])
+            results = []
+            for key, measurements, fetch_timings in pool.imap_unordered(
+                    fetch_measurement, [checks[key][0][2] for key in due]):
+                for host, service, args in checks[key]:
+                    status, output = check_fetched(args, measurements,
+                            fetch_timings)
+                    results.append((host, service, status, output))
+                if not once:
+                    heapq.heappush(schedule, (next_poll(measurements,
+                            intervals[key], min_interval, jitter), key))
+            writer.write(results)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class LiveCheck:
+    """
+    Check of a measurement following its result stream
+    the latest parsed result of each probe is kept with the outcome of
+    its checks, so only arriving results are parsed and checked
+    """
+
+    def __init__(self, args):
+        """Initiate the check of the parsed arguments args"""
+        self.args = args
+        self.plan = compile_plan(args)
+        self.parser = measurement_class(self.plan.measurement_type)
+        #(parsed result, outcome) of each probe, None without data
+        self.probes = collections.OrderedDict()
+
+    def update(self, result):
+        """Replace the result of a probe with result unless it is older"""
+        probe_id, payload = result[1], result[5]
+        if self.args.skip_disconnected and get_probe_index() is not None \
+                and not list(get_probe_index().connected([result])):
+            return
+        previous = self.probes.get(probe_id)
+        if payload is None:
+            if previous is None:
+                self.probes[probe_id] = None
+            return
+        if previous is not None and payload[1] < previous[0].check_time:
+            return
+        measurement = self.parser(probe_id, payload)
+        self.probes[probe_id] = (measurement,
+                self.plan.apply_recorded(measurement, ProbeMessage(0)))
+
+    def result(self):
+        """Check the kept results, return the nagios (status, output)"""
+        message = ProbeMessage.from_args(self.args)
+        for probe_id, probe in self.probes.iteritems():
+            if probe is None:
+                message.add_error(probe_id, "No data")
+            else:
+                self.plan.apply_cached(probe[0], message, probe[1])
+        save_baselines()
+        return message.result()
+
+
+def submit_live(checks, submit, submitted, refresh, error=None):
+    """
+    Submit the results of checks whose status changed
+    unchanged results are submitted again once refresh seconds old,
+    submitted holds the last (status, time) of each check. with error
+    the checks are UNKNOWN with error as output
+    """
+    now = time.time()
+    results = []
+    for host, service, live in checks:
+        try:
+            if error is not None:
+                raise CheckError(error)
+            status, output = live.result()
+        except CheckError as check_error:
+            status, output = 3, str(check_error)
+        last = submitted.get((host, service))
+        if last is None or last[0] != status or now - last[1] >= refresh:
+            submitted[(host, service)] = (status, now)
+            results.append((host, service, status, output))
+    if results:
+        submit(results)
+
+
+def follow_stream(measurement_id, checks, submit, stop, stream_url,
+        refresh=300, settle=1, retry=30):
+    """
+    Check the definitions of a measurement as its results arrive
+    checks are (host, service, LiveCheck), the checks are evaluated at
+    most every settle seconds and their results passed to submit. the
+    latest results are fetched first and again every retry seconds while
+    the stream at stream_url is lost, so the checks keep their status
+    and the results missed meanwhile are caught up. runs until the stop
+    event is set
+    """
+    url = '%s/measurement/%s/stream/' % (stream_url.rstrip('/'),
+            measurement_id)
+    submitted = {}
+    while not stop.is_set():
+        try:
+            for result in get_measurements(measurement_id):
+                for _, _, live in checks:
+                    live.update(result)
+            submit_live(checks, submit, submitted, refresh)
+        except CheckError as error:
+            submit_live(checks, submit, submitted, refresh, str(error))
+            stop.wait(retry)
+            continue
+        except Exception as error:
+            submit_live(checks, submit, submitted, refresh,
+                    "Unknown: %s" % error)
+            stop.wait(retry)
+            continue
+        try:
+            checked = time.time()
+            for result in get_client().iter_stream(url):
+                if stop.is_set():
+                    return
+                if result is not None:
+                    for _, _, live in checks:
+                        live.update(result)
+                if time.time() - checked >= settle:
+                    submit_live(checks, submit, submitted, refresh)
+                    checked = time.time()
+        except Exception:
+            #the stream is lost, /latest/ is polled until it is back
+            pass
+        stop.wait(retry)
+
+
+def run_stream(definitions, writer, stream_url, refresh=300, settle=1,
+        retry=30, duration=None):
+    """
+    Follow the result streams of the measurements of definitions
+    definitions are (host, service, check command line). each
+    measurement is followed from stream_url by a thread of its own,
+    results are submitted with writer as their status changes. runs
+    forever or for duration seconds
+    """
+    checks = {}
+    invalid = []
+    for host, service, definition in definitions:
+        try:
+            live_check = LiveCheck(parse_definition(definition,
+                    mode='stream'))
+        except CheckError as error:
+            invalid.append((host, service, 3, str(error)))
+            continue
+        except Exception as error:
+            invalid.append((host, service, 3, "Unknown: %s" % error))
+            continue
+        checks.setdefault(live_check.args.measurement_id, []).append(
+                (host, service, live_check))
+    if invalid:
+        writer.write(invalid)
+
+    #the threads hand their results over, only this one writes
+    submissions = Queue.Queue()
+    stop = threading.Event()
+    threads = []
+    for measurement_id, live_checks in checks.iteritems():
+        thread = threading.Thread(target=follow_stream,
+                args=(measurement_id, live_checks, submissions.put, stop,
+                stream_url, refresh, settle, retry))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    deadline = duration and time.time() + duration
+    try:
+        while checks and (not deadline or time.time() < deadline):
+            try:
+                writer.write(submissions.get(timeout=1))
+            except Queue.Empty:
+                pass
+    finally:
+        #streams are read line by line, keep-alives included
+        stop.set()
+        for thread in threads:
+            thread.join(1)
+
+
+def configure(args):
+    """Configure what the checks of this process share from args"""
+    global CONFIGURED
+    configure_client(args)
+    configure_probe_index(args)
+    configure_timings(args)
+    configure_shards(args)
+    CONFIGURED = args
+
+
+def check_shared_options(args, mode):
+    """
+    Raise a CheckError if args of a check run by mode set a shared option
+    other than the process was configured with, e.g. another --api-url
+    options left at their default are those of the process
+    """
+    parser = build_parser([])
+    for option in SHARED_OPTIONS:
+        value = getattr(args, option)
+        if value != parser.get_default(option) and (CONFIGURED is None or
+                value != getattr(CONFIGURED, option)):
+            raise CheckError("Unknown: --%s can't differ per check, give "
+                    "it to %s instead" % (option.replace('_', '-'), mode))
 
 
 def main():
     """main function"""
     args = arg_parse()
-    message = ProbeMessage(args.verbose)
-    measurements =  get_measurements(args.measurement_id)
-    parsed_measurements = parse_measurements(
-            measurements, args.name, message)
-    check_measurements(parsed_measurements, args, message)
-    message.exit()
+    configure(args)
+    if args.name == 'server':
+        serve(args.socket)
+    elif args.name == 'index':
+        if not args.probe_index:
+            print "Unknown: index needs --probe-index"
+            sys.exit(3)
+        try:
+            count = ProbeIndex(args.probe_index).refresh(get_client())
+        except CheckError as error:
+            print error
+            sys.exit(3)
+        print "OK: %d probes indexed" % count
+    elif args.name == 'poll':
+        if args.command_file:
+            writer = CommandFileWriter(args.command_file)
+        else:
+            writer = SpoolWriter(args.spool_dir)
+        try:
+            run_poll(read_poll_definitions(args.definitions), writer,
+                    args.workers, args.min_interval, args.jitter, args.once,
+                    args.timings)
+        except CheckError as error:
+            print error
+            sys.exit(3)
+        except KeyboardInterrupt:
+            pass
+    elif args.name == 'stream':
+        if args.command_file:
+            writer = CommandFileWriter(args.command_file)
+        else:
+            writer = SpoolWriter(args.spool_dir)
+        try:
+            run_stream(read_poll_definitions(args.definitions), writer,
+                    args.stream_url, args.refresh, args.settle, args.retry,
+                    args.duration)
+        except CheckError as error:
+            print error
+            sys.exit(3)
+        except KeyboardInterrupt:
+            pass
+    elif args.name == 'batch':
+        for definition, status, output in run_batch(
+                read_definitions(args.definitions), args.workers,
+                args.timings):
+            print json.dumps({'check': definition, 'status': status,
+                    'output': output})
+    else:
+        run_check(args)
 
 
 if __name__ == '__main__':
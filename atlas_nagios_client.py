@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Client for atlas_nagios.py running in server mode
+
+Usage: atlas_nagios_client.py [--socket PATH] <atlas_nagios.py arguments>
+
+Only the standard library is imported so the check returns as fast as
+possible; the output and exit code are the ones atlas_nagios.py would give.
+"""
+import os
+import sys
+import json
+import socket
+
+DEFAULT_SOCKET = os.environ.get('ATLAS_NAGIOS_SOCKET',
+        '/var/run/atlas_nagios/atlas_nagios.sock')
+
+
+def request_check(path, argv):
+    """Send argv to the server listening on path, return its reply"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(argv) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        reply = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            reply.append(data)
+    finally:
+        sock.close()
+    return json.loads(''.join(reply))
+
+
+def main():
+    """main function"""
+    argv = sys.argv[1:]
+    path = DEFAULT_SOCKET
+    if argv[:1] == ['--socket']:
+        path, argv = argv[1], argv[2:]
+    try:
+        reply = request_check(path, argv)
+    except (socket.error, ValueError) as error:
+        sys.stdout.write('Unknown: check server %s failed: %s\n' % (
+                path, error))
+        sys.exit(3)
+    sys.stdout.write(reply['stdout'].encode('utf-8'))
+    sys.stderr.write(reply['stderr'].encode('utf-8'))
+    sys.exit(reply['code'])
+
+
+if __name__ == '__main__':
+    main()
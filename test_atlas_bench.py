@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""Tests of the comparison of benchmark runs"""
+import unittest
+
+import atlas_bench
+
+
+class TestRegressions(unittest.TestCase):
+    """Flagging metrics worse than the previous run"""
+    previous = {'wall': 1.0, 'cpu': 0.5, 'rss_kb': 20000, 'fetch': 0.25,
+            'check': 0.5}
+
+    def regressions(self, previous=None, threshold=0.2, **metrics):
+        """Return the regressions of previous with metrics changed"""
+        result = dict(self.previous, **metrics)
+        if previous is None:
+            previous = self.previous
+        return atlas_bench.regressions(result, previous, threshold)
+
+    def test_no_previous(self):
+        """A first run has no regressions"""
+        self.assertEqual(atlas_bench.regressions(self.previous, None, 0.2),
+                [])
+
+    def test_unchanged(self):
+        """The same run has no regressions"""
+        self.assertEqual(self.regressions(), [])
+
+    def test_worse(self):
+        """Metrics worse by more than the threshold are flagged"""
+        self.assertEqual(self.regressions(wall=1.5, rss_kb=30000),
+                ['wall', 'rss_kb'])
+
+    def test_better(self):
+        """Faster runs aren't flagged"""
+        self.assertEqual(self.regressions(wall=0.1, check=0), [])
+
+    def test_threshold_boundary(self):
+        """Worse by exactly the threshold isn't flagged, more is"""
+        self.assertEqual(self.regressions(threshold=0.5, cpu=0.75), [])
+        self.assertEqual(self.regressions(threshold=0.5, cpu=0.7501),
+                ['cpu'])
+        self.assertEqual(self.regressions(threshold=0, cpu=0.5), [])
+        self.assertEqual(self.regressions(threshold=0, cpu=0.5001),
+                ['cpu'])
+
+    def test_zero_previous(self):
+        """A metric which was zero can't regress by a fraction"""
+        previous = dict(self.previous, fetch=0)
+        self.assertEqual(self.regressions(previous, fetch=1.0), [])
+
+    def test_missing_metrics(self):
+        """Metrics missing from either run are skipped"""
+        with_state = dict(self.previous, state=0.1)
+        self.assertEqual(self.regressions(with_state), [])
+        self.assertEqual(self.regressions(state=10.0), [])
+        self.assertEqual(self.regressions(with_state, state=0.5),
+                ['state'])
+        without_fetch = dict(self.previous)
+        del without_fetch['fetch']
+        self.assertEqual(atlas_bench.regressions(without_fetch,
+                self.previous, 0.2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,587 @@
+#!/usr/bin/python
+"""Tests of the file formats atlas_nagios reads and writes"""
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+import atlas_mock
+import atlas_nagios
+
+
+def chunked(data, size):
+    """Split data in chunks of size characters"""
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+class TestIterJsonArray(unittest.TestCase):
+    """Decoding of a json array split in chunks"""
+    elements = [
+        {'prb_id': 1, 'result': [{'rtt': 1.5}, {'x': '*'}]},
+        {'name': 'quote " and \\ backslash', 'braces': '{[}]'},
+        {'nested': {'list': [1, [2, [3]]], 'text': '"]}'}},
+        12345678,
+        -0.25,
+        'a string with , and ] in it',
+        None,
+        True,
+        [],
+        {},
+    ]
+
+    def decode(self, chunks):
+        """Return the decoded elements of chunks as a list"""
+        return list(atlas_nagios.iter_json_array(chunks))
+
+    def test_single_chunk(self):
+        """The whole array in one chunk"""
+        self.assertEqual(self.decode([json.dumps(self.elements)]),
+                self.elements)
+
+    def test_chunk_boundaries(self):
+        """Chunks splitting the elements anywhere"""
+        data = json.dumps(self.elements, indent=1)
+        for size in range(1, 40):
+            self.assertEqual(self.decode(chunked(data, size)),
+                    self.elements, 'chunks of %d' % size)
+
+    def test_numbers_across_chunks(self):
+        """A number isn't cut where a chunk ends"""
+        self.assertEqual(self.decode(['[12', '34, 5', '6.', '75]']),
+                [1234, 56.75])
+
+    def test_escapes_across_chunks(self):
+        """An escaped quote split from its backslash"""
+        data = json.dumps([{'a': 'x\\"}{'}, 'y\\'])
+        for split in range(1, len(data)):
+            self.assertEqual(self.decode([data[:split], data[split:]]),
+                    [{'a': 'x\\"}{'}, 'y\\'])
+
+    def test_empty(self):
+        """An empty array, with whitespace"""
+        self.assertEqual(self.decode([' \n[', ' ', ']\n']), [])
+        self.assertEqual(self.decode(['[]']), [])
+
+    def test_elements_yielded_before_the_end(self):
+        """Elements are decoded before the array is complete"""
+        elements = atlas_nagios.iter_json_array(iter(['[{"a": 1}, ',
+                '{"b": 2}']))
+        self.assertEqual(next(elements), {'a': 1})
+        self.assertEqual(next(elements), {'b': 2})
+        self.assertRaises(ValueError, next, elements)
+
+    def test_truncated(self):
+        """A truncated array is an error"""
+        data = json.dumps(self.elements)
+        for end in (0, 1, len(data) // 2, len(data) - 1):
+            self.assertRaises(ValueError, self.decode, chunked(data[:end],
+                    7))
+
+    def test_not_an_array(self):
+        """A top level object is an error"""
+        self.assertRaises(ValueError, self.decode, ['{"a": 1}'])
+
+
+class TestProbeMessage(unittest.TestCase):
+    """Deciding the status from the probe and result thresholds"""
+
+    def message(self, statuses, **options):
+        """Return a ProbeMessage with one result per (probe, status)"""
+        message = atlas_nagios.ProbeMessage(options.pop('verbose', 0),
+                **options)
+        for probe, status in statuses:
+            message.add(status, probe, "status %d of %s", (status, probe))
+        return message
+
+    def test_defaults(self):
+        """By default one error probe is an ERROR, one warn probe is OK"""
+        for statuses, status in (([(1, 0), (2, 0)], 0), ([(1, 0), (2, 1)], 0),
+                ([(1, 1), (2, 1)], 1), ([(1, 2)], 2), ([(1, 1)] * 5, 0),
+                ([], 0)):
+            message = atlas_nagios.ProbeMessage.from_args(
+                    atlas_nagios.arg_parse(['ping', '1']))
+            for probe, probe_status in statuses:
+                message.add(probe_status, probe, "message", ())
+            self.assertEqual(message.status(), status, statuses)
+
+    def test_warn_probes(self):
+        """WARN from warn_probes probes with a warn or error condition"""
+        statuses = [(1, 1), (2, 1), (3, 2)]
+        self.assertEqual(self.message(statuses, warn_probes=3,
+                crit_probes=2).status(), 1)
+        self.assertEqual(self.message(statuses, warn_probes=4,
+                crit_probes=2).status(), 0)
+        self.assertEqual(self.message(statuses, warn_probes=0,
+                crit_probes=2).status(), 1)
+
+    def test_crit_probes(self):
+        """ERROR from crit_probes probes with an error condition"""
+        statuses = [(1, 2), (2, 2), (3, 0)]
+        self.assertEqual(self.message(statuses, warn_probes=5,
+                crit_probes=2).status(), 2)
+        self.assertEqual(self.message(statuses, warn_probes=5,
+                crit_probes=3).status(), 0)
+
+    def test_worst_status_of_a_probe(self):
+        """A probe counts once, with its worst status"""
+        statuses = [(1, 1), (1, 0), (1, 1)]
+        self.assertEqual(self.message(statuses, warn_probes=2).status(), 0)
+        self.assertEqual(self.message(statuses + [(1, 2)],
+                warn_probes=2).status(), 2)
+
+    def test_result_thresholds(self):
+        """-W/-C count results, they are off unless given"""
+        statuses = [(1, 1), (1, 1), (1, 2)]
+        options = dict(warn_probes=2, crit_probes=2)
+        self.assertEqual(self.message(statuses, **options).status(), 0)
+        self.assertEqual(self.message(statuses, warn_results=3,
+                **options).status(), 1)
+        self.assertEqual(self.message(statuses, warn_results=4,
+                **options).status(), 0)
+        self.assertEqual(self.message(statuses, crit_results=1,
+                **options).status(), 2)
+        self.assertEqual(self.message(statuses[:2], crit_results=1,
+                **options).status(), 0)
+
+    def test_results_of_a_check_run(self):
+        """Messages between open_result and close_result are one result"""
+        message = atlas_nagios.ProbeMessage(0, warn_probes=2, crit_probes=2,
+                warn_results=2)
+        for status in (1, 0, 1):
+            message.open_result()
+            message.add(status, 1, "message", ())
+            message.add(0, 1, "message", ())
+            message.close_result()
+        self.assertEqual(message.results, [1, 2, 0])
+        self.assertEqual(message.checks, [4, 2, 0])
+        self.assertEqual(message.status(), 1)
+
+    def test_tolerance(self):
+        """A probe has a condition once over the tolerated fraction"""
+        statuses = [(1, 0), (1, 0), (1, 0), (1, 2)]
+        self.assertEqual(self.message(statuses, tolerance=0.25).status(), 0)
+        self.assertEqual(self.message(statuses, tolerance=0.2).status(), 2)
+        statuses = [(1, 0), (1, 1), (1, 2), (2, 0), (2, 2), (2, 2)]
+        message = self.message(statuses, tolerance=0.5, warn_probes=3)
+        self.assertEqual(message.probe_status(1), 1)
+        self.assertEqual(message.probe_status(2), 2)
+        self.assertEqual(message.probe_counts(), [0, 1, 1])
+        self.assertEqual(message.status(), 2)
+
+    def test_groups(self):
+        """Groups with warn/error probes are counted and listed"""
+        groups = {1: 'AS1', 2: 'AS1', 3: 'AS2', 4: 'AS3'}
+        statuses = [(1, 1), (2, 2), (3, 1), (4, 0)]
+        options = dict(warn_probes=10, crit_probes=10, group=groups.get)
+        message = self.message(statuses, **options)
+        self.assertEqual(message.group_counts(), {'AS1': [0, 1, 1],
+                'AS2': [0, 1, 0], 'AS3': [1, 0, 0]})
+        self.assertEqual(message.status(), 0)
+        self.assertEqual(self.message(statuses, warn_groups=2,
+                **options).status(), 1)
+        self.assertEqual(self.message(statuses, warn_groups=3,
+                **options).status(), 0)
+        self.assertEqual(self.message(statuses, crit_groups=1,
+                **options).status(), 2)
+        self.assertEqual(self.message(statuses, crit_groups=2,
+                **options).status(), 0)
+        status, output = self.message(statuses, warn_groups=2,
+                **options).result()
+        self.assertEqual(output, "WARN: 3 (AS1 2/2, AS2 1/1) | "
+                "probes_ok=25%")
+
+    def test_limits(self):
+        """A performance data statistic above its limit is an ERROR"""
+        message = self.message([(1, 0)], limits=(('rtt', 'max', 10),))
+        message.add_perf('rtt', 10)
+        self.assertEqual(message.status(), 0)
+        message.add_perf('rtt', 10.5)
+        status, output = message.result()
+        self.assertEqual(status, 2)
+        self.assertTrue(output.startswith("ERROR: 0, rtt max 10.5 above 10 "
+                "| "), output)
+
+    def test_result(self):
+        """The first line has the status and count, then the messages"""
+        statuses = [(1, 2), (2, 1), (3, 1), (4, 0)]
+        self.assertEqual(self.message(statuses).result(),
+                (2, "ERROR: 1 | probes_ok=25%"))
+        self.assertEqual(self.message(statuses, crit_probes=2).result(),
+                (1, "WARN: 3 | probes_ok=25%"))
+        self.assertEqual(self.message([(1, 0), (2, 0)]).result(),
+                (0, "OK: 2 | probes_ok=100%"))
+        status, output = self.message(statuses + [(5, 1)],
+                verbose=1).result()
+        self.assertEqual(output.split("\n"), ["ERROR: 1 | probes_ok=20%",
+                "ERROR: 1: status 2 of 1",
+                "WARN: 3: status 1 of 2, status 1 of 3, status 1 of 5"])
+
+    def test_verbose_grouping(self):
+        """Identical messages are printed once with their count"""
+        message = atlas_nagios.ProbeMessage(2)
+        for probe in range(3):
+            message.add_ok(probe, "fresh")
+        message.add_ok(3, "rtt %s", 1)
+        self.assertEqual(message.result()[1].split("\n")[1],
+                "OK: 4: fresh x3, rtt 1")
+
+
+class TestResourceRecord(unittest.TestCase):
+    """Tokenizing dns answers in presentation format"""
+    zone = 'example.com.'
+
+    def record(self, rdata, rrtype):
+        """Return the ResourceRecord of an answer with rdata"""
+        return atlas_nagios.parse_record('%s 3600 IN %s %s' % (self.zone,
+                rrtype, rdata))
+
+    def test_fields(self):
+        """The owner, ttl, class and type come first"""
+        record = self.record('192.0.2.1', 'A')
+        self.assertEqual((record.owner, record.ttl, record.rrclass,
+                record.rrtype, record.rdata), (self.zone, '3600', 'IN', 'A',
+                ('192.0.2.1',)))
+        self.assertEqual(record.rdata_fields(1), ('192.0.2.1',))
+
+    def test_dnskey(self):
+        """The key is the remaining tokens of the rdata"""
+        record = self.record('257 3 8 AwEAAagAIKlVZrpC6Ia7gEzahOR+9W29 '
+                'euxhJhVVLOyQbSEW0O8gcCjF FVQUTf6v58fLjwBd0YI0EzrAcQqB',
+                'DNSKEY')
+        self.assertEqual(record.rdata_fields(4), ('257', '3', '8',
+                'AwEAAagAIKlVZrpC6Ia7gEzahOR+9W29 euxhJhVVLOyQbSEW0O8gcCjF '
+                'FVQUTf6v58fLjwBd0YI0EzrAcQqB'))
+
+    def test_ds(self):
+        """A digest split in several tokens is one field"""
+        record = self.record('12345  8 2   0123456789ABCDEF\t'
+                '0123456789ABCDEF', 'DS')
+        self.assertEqual(record.rdata_fields(4), ('12345', '8', '2',
+                '0123456789ABCDEF 0123456789ABCDEF'))
+
+    def test_missing_fields(self):
+        """Missing rdata fields are None"""
+        self.assertEqual(self.record('12345 8', 'DS').rdata_fields(4),
+                ('12345', '8', None, None))
+
+    def test_quoted(self):
+        """Quoted strings keep their spaces and escaped quotes"""
+        record = self.record('"v=spf1  include:example.net -all" '
+                '"say \\"hi there\\"" plain', 'TXT')
+        self.assertEqual(record.rdata, ('"v=spf1  include:example.net -all"',
+                '"say \\"hi there\\""', 'plain'))
+        self.assertEqual(record.rdata_fields(1), (
+                '"v=spf1  include:example.net -all" "say \\"hi there\\"" '
+                'plain',))
+
+    def test_shared(self):
+        """Identical answers share their record and tokens"""
+        answer = '%s 300 IN A 192.0.2.1' % self.zone
+        record = atlas_nagios.parse_record(answer)
+        self.assertTrue(atlas_nagios.parse_record(''.join(list(answer)))
+                is record)
+        other = atlas_nagios.parse_record('%s 300 IN A 192.0.2.2' % self.zone)
+        self.assertTrue(other.owner is record.owner)
+
+    def test_not_a_record(self):
+        """An answer of less than four tokens has no rrtype"""
+        record = atlas_nagios.parse_record('garbage 300')
+        self.assertEqual(record.rrtype, None)
+        self.assertEqual(record.rdata, ('garbage', '300'))
+        self.assertRaises(atlas_nagios.CheckError,
+                atlas_nagios.parse_record, {'rdata': '192.0.2.1'})
+
+    def check(self, argv, answers):
+        """Return the (status, output) of a dns check of answers"""
+        payload = [1, int(time.time()), {'additional': 0, 'authority': 0,
+                'question': '%s IN %s' % (self.zone, argv[1]),
+                'rcode': 'NOERROR', 'flags': 'qr rd ra', 'answer': answers}]
+        try:
+            return atlas_nagios.check_result(atlas_nagios.arg_parse(argv),
+                    [[1, 1, 0, 0, 0, payload]])
+        except atlas_nagios.CheckError as error:
+            return 3, str(error)
+
+    def test_check_ds(self):
+        """The DS fields are checked, RRSIG records are skipped"""
+        answers = ['%s 3600 IN DS 12345 8 2 0123 4567' % self.zone,
+                '%s 3600 IN RRSIG DS 8 2 3600 20300101000000 20150101000000 '
+                '12345 %s c2ln bmF0 dXJl' % (self.zone, self.zone)]
+        argv = ['dns', 'DS', '1', '--keytag', '12345', '--digest',
+                '0123 4567']
+        self.assertEqual(self.check(argv, answers)[0], 0)
+        self.assertEqual(self.check(argv[:-1] + ['01234567'], answers)[0],
+                2)
+
+    def test_unparsable(self):
+        """An answer which isn't a record is UNKNOWN"""
+        for answer in ('garbage', None, {'rdata': '192.0.2.1'}):
+            status, output = self.check(['dns', 'A', '1', '--a-record',
+                    '192.0.2.1'], ['%s 300 IN A 192.0.2.1' % self.zone,
+                    answer])
+            self.assertEqual(status, 3, output)
+            self.assertTrue(output.startswith(
+                    'Unknown: Unparsable dns record'), output)
+
+
+class TempDirTest(unittest.TestCase):
+    """Test case working in a temporary directory"""
+
+    def setUp(self):
+        """Create the directory"""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the directory"""
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        """Return the path of name in the directory"""
+        return os.path.join(self.directory, name)
+
+
+class TestSnapshot(TempDirTest):
+    """Writing and reading back snapshots"""
+    metadata = {'measurement_id': 1000001, 'time': 1420070400}
+
+    def results(self, count):
+        """Return count results"""
+        return [{'prb_id': probe, 'result': [{'rtt': probe / 4.0}],
+                'name': 'result "%d" {}' % probe} for probe in range(count)]
+
+    def write(self, name, results):
+        """Write results to the snapshot name and return the Snapshot"""
+        snapshot = atlas_nagios.Snapshot(self.path(name))
+        self.assertEqual(list(snapshot.write(iter(results), self.metadata)),
+                results)
+        return snapshot
+
+    def test_round_trip(self):
+        """Results and metadata are read back as written"""
+        for count in (0, 1, atlas_nagios.SNAPSHOT_BLOCK,
+                atlas_nagios.SNAPSHOT_BLOCK * 2 + 1):
+            results = self.results(count)
+            snapshot = self.write('%d.snap' % count, results)
+            self.assertEqual(snapshot.metadata(), self.metadata)
+            self.assertEqual(list(snapshot.results()), results)
+
+    def test_format(self):
+        """A magic line and length prefixed zlib compressed json records"""
+        results = self.results(atlas_nagios.SNAPSHOT_BLOCK + 1)
+        self.write('format.snap', results)
+        with open(self.path('format.snap'), 'rb') as snapshot:
+            data = snapshot.read()
+        self.assertTrue(data.startswith(atlas_nagios.Snapshot.magic))
+        offset = len(atlas_nagios.Snapshot.magic)
+        records = []
+        while offset < len(data):
+            length, = struct.unpack_from('>I', data, offset)
+            offset += 4
+            records.append(json.loads(zlib.decompress(
+                    data[offset:offset + length])))
+            offset += length
+        self.assertEqual(offset, len(data))
+        self.assertEqual(records, [self.metadata,
+                results[:atlas_nagios.SNAPSHOT_BLOCK],
+                results[atlas_nagios.SNAPSHOT_BLOCK:]])
+
+    def test_replaced_once_written(self):
+        """The file only appears once the results are exhausted"""
+        snapshot = atlas_nagios.Snapshot(self.path('partial.snap'))
+        results = snapshot.write(iter(self.results(3)), self.metadata)
+        next(results)
+        self.assertFalse(os.path.exists(snapshot.path))
+        list(results)
+        self.assertTrue(os.path.exists(snapshot.path))
+        self.assertEqual(os.listdir(self.directory), ['partial.snap'])
+
+    def test_truncated(self):
+        """A truncated snapshot is UNKNOWN"""
+        self.write('full.snap', self.results(10))
+        with open(self.path('full.snap'), 'rb') as snapshot:
+            data = snapshot.read()
+        magic = len(atlas_nagios.Snapshot.magic)
+        for end in (magic - 1, magic + 2, magic + 6, len(data) - 1):
+            with open(self.path('cut.snap'), 'wb') as snapshot:
+                snapshot.write(data[:end])
+            snapshot = atlas_nagios.Snapshot(self.path('cut.snap'))
+            with self.assertRaises(atlas_nagios.CheckError):
+                snapshot.metadata()
+                list(snapshot.results())
+
+    def test_missing(self):
+        """A missing snapshot is UNKNOWN"""
+        snapshot = atlas_nagios.Snapshot(self.path('missing.snap'))
+        self.assertRaises(atlas_nagios.CheckError, snapshot.metadata)
+
+    def test_unwritable(self):
+        """A snapshot which can't be written is UNKNOWN"""
+        snapshot = atlas_nagios.Snapshot(self.path('missing/x.snap'))
+        with self.assertRaises(atlas_nagios.CheckError):
+            list(snapshot.write(iter(self.results(1)), self.metadata))
+
+
+class WindowClient:
+    """Api client serving the results of a window from a list"""
+
+    def __init__(self, results):
+        """Initiate the client with the results of the measurement"""
+        self.results = results
+
+    def iter_results(self, measurement_id, start, stop, page=3600):
+        """Return the results between start and stop"""
+        return [result for result in self.results
+                if start <= result[5][1] < stop]
+
+
+class TestWindowState(TempDirTest):
+    """Fetching a window incrementally with --window-state"""
+
+    def setUp(self):
+        """Serve the results from a WindowClient"""
+        TempDirTest.setUp(self)
+        self.client = atlas_nagios.CLIENT
+        self.now = int(time.time())
+        atlas_nagios.CLIENT = WindowClient([self.result(probe, 600)
+                for probe in range(3)])
+
+    def tearDown(self):
+        """Restore the api client"""
+        atlas_nagios.CLIENT = self.client
+        TempDirTest.tearDown(self)
+
+    def result(self, probe, age):
+        """Return a result of probe age seconds old"""
+        return [1, probe, 0, 0, 0, [0, self.now - age]]
+
+    def window(self, late=900):
+        """Return the window results fetched with the state"""
+        return atlas_nagios.get_window(1, 3600, state_dir=self.directory,
+                late=late)
+
+    def test_late_results(self):
+        """Results uploaded after the last run are fetched once"""
+        self.assertEqual(len(self.window()), 3)
+        atlas_nagios.CLIENT.results.append(self.result(3, 300))
+        results = self.window()
+        self.assertEqual(sorted(result[1] for result in results),
+                [0, 1, 2, 3])
+        self.assertEqual(len(self.window()), 4)
+
+    def test_without_margin(self):
+        """Without the margin only newer results are fetched"""
+        self.window(late=0)
+        atlas_nagios.CLIENT.results.append(self.result(3, 300))
+        self.assertEqual(len(self.window(late=0)), 3)
+
+    def test_expired(self):
+        """Results older than the window are dropped"""
+        atlas_nagios.CLIENT.results.append(self.result(3, 4000))
+        self.assertEqual(len(self.window()), 3)
+
+
+class TestOutcomeExport(TempDirTest):
+    """Exported outcomes of checks"""
+
+    def export(self, argv, results):
+        """Check results with argv, return the exported rows"""
+        path = self.path('outcomes.ndjson')
+        args = atlas_nagios.arg_parse(argv + ['--export', path])
+        atlas_nagios.check_result(args, results)
+        with open(path) as export:
+            return [json.loads(line) for line in export]
+
+    def test_measurement_age(self):
+        """The age is exported in seconds, like the maximum age"""
+        now = int(time.time())
+        results = atlas_mock.generate('ping', 2, 0, now=now - 600)
+        results += atlas_mock.generate('ping', 1, 0, now=now - 7200)
+        rows = [row for row in self.export(['ping', '1'], results)
+                if row['check'] == 'measurement_age']
+        self.assertEqual([row['status'] for row in rows], [0, 0, 2])
+        for row, age in zip(rows, (600, 600, 7200)):
+            self.assertEqual(row['expected'], 3600)
+            self.assertTrue(age <= row['measured'] < age + 60, row)
+
+    def test_thresholds(self):
+        """Checks with a threshold export it with the measured value"""
+        results = atlas_mock.generate('ping', 1, 0)
+        rows = [row for row in self.export(['ping', '1', '--rtt_max',
+                '1000'], results) if row['check'] != 'measurement_age']
+        self.assertEqual([row['check'] for row in rows], ['rtt_max'])
+        self.assertEqual(rows[0]['expected'], 1000)
+        self.assertTrue(isinstance(rows[0]['measured'], float), rows)
+
+
+class TestPathBaseline(TempDirTest):
+    """Learning and comparing traceroute paths"""
+
+    def test_learning(self):
+        """The path of a new probe becomes its baseline"""
+        baseline = atlas_nagios.PathBaseline(self.path('1.paths'))
+        self.assertEqual(baseline.paths, {})
+        self.assertEqual(baseline.compare(1, 'aaaa'), 'aaaa')
+        self.assertTrue(baseline.changed)
+        self.assertEqual(baseline.compare('1', 'aaaa'), 'aaaa')
+
+    def test_change(self):
+        """A changed path is compared with the baseline, kept unless update"""
+        baseline = atlas_nagios.PathBaseline(self.path('1.paths'))
+        baseline.compare(1, 'aaaa')
+        self.assertEqual(baseline.compare(1, 'bbbb'), 'aaaa')
+        self.assertEqual(baseline.paths, {'1': 'aaaa'})
+        self.assertEqual(baseline.compare(1, 'bbbb', update=True), 'bbbb')
+        self.assertEqual(baseline.compare(1, 'aaaa'), 'bbbb')
+
+    def test_save(self):
+        """Learned paths are saved and loaded back"""
+        path = self.path('sub/1.paths')
+        baseline = atlas_nagios.PathBaseline(path)
+        baseline.compare(1, 'aaaa')
+        baseline.compare(2, 'bbbb')
+        baseline.save()
+        self.assertFalse(baseline.changed)
+        loaded = atlas_nagios.PathBaseline(path)
+        self.assertEqual(loaded.paths, {'1': 'aaaa', '2': 'bbbb'})
+        self.assertEqual(loaded.compare(2, 'cccc'), 'bbbb')
+        self.assertFalse(loaded.changed)
+
+    def test_unchanged_not_written(self):
+        """A baseline without new paths isn't written"""
+        baseline = atlas_nagios.PathBaseline(self.path('1.paths'))
+        baseline.save()
+        self.assertFalse(os.path.exists(self.path('1.paths')))
+
+    def test_invalid(self):
+        """An unreadable baseline knows no probe"""
+        with open(self.path('1.paths'), 'w') as baseline:
+            baseline.write('{"1": ')
+        self.assertEqual(atlas_nagios.PathBaseline(self.path('1.paths')).paths,
+                {})
+
+    def test_per_thread(self):
+        """Saving the baselines of a thread leaves the others alone"""
+        path = self.path('1.paths')
+        baseline = atlas_nagios.get_baseline(path)
+        baseline.compare(1, 'aaaa')
+
+        def check():
+            """Learn a path and save it from another thread"""
+            atlas_nagios.get_baseline(path).compare(2, 'bbbb')
+            atlas_nagios.save_baselines()
+        thread = threading.Thread(target=check)
+        thread.start()
+        thread.join()
+        self.assertTrue(atlas_nagios.get_baseline(path) is baseline)
+        atlas_nagios.save_baselines()
+        self.assertFalse(atlas_nagios.get_baseline(path) is baseline)
+        atlas_nagios.save_baselines()
+
+
+if __name__ == '__main__':
+    unittest.main()